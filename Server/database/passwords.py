@@ -0,0 +1,77 @@
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+
+load_dotenv()
+
+scrypt_n = int(os.getenv("PASSWORD_SCRYPT_N", str(2 ** 14)))
+scrypt_r = int(os.getenv("PASSWORD_SCRYPT_R", "8"))
+scrypt_p = int(os.getenv("PASSWORD_SCRYPT_P", "1"))
+hash_workers = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+
+salt_size = 16
+key_size = 32
+
+# scrypt releases the GIL, so a small thread pool is enough to keep it off
+# the event loop. The pool also caps how many memory-hard hashes run at once.
+executor = ThreadPoolExecutor(max_workers=hash_workers, thread_name_prefix="passwords")
+
+def encode(data: bytes) -> str:
+    return base64.b64encode(data).decode()
+
+def derive(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(
+        password.encode(),
+        salt=salt,
+        n=n,
+        r=r,
+        p=p,
+        maxmem=128 * r * (n + p) + (1 << 20),
+        dklen=key_size
+    )
+
+def _hash_password(password: str) -> str:
+    salt = secrets.token_bytes(salt_size)
+    key = derive(password, salt, scrypt_n, scrypt_r, scrypt_p)
+
+    return f"scrypt${scrypt_n}${scrypt_r}${scrypt_p}${encode(salt)}${encode(key)}"
+
+def is_legacy(password_hash: str) -> bool:
+    return "$" not in password_hash
+
+# Old accounts were stored as a bare SHA3-256 hex digest.
+def _verify_password(password: str, password_hash: str) -> bool:
+    if is_legacy(password_hash):
+        return hmac.compare_digest(hashlib.sha3_256(password.encode()).hexdigest(), password_hash)
+
+    try:
+        scheme, n, r, p, salt, key = password_hash.split("$")
+    except ValueError:
+        return False
+
+    if scheme != "scrypt":
+        return False
+
+    expected = base64.b64decode(key)
+    actual = derive(password, base64.b64decode(salt), int(n), int(r), int(p))
+
+    return hmac.compare_digest(actual, expected)
+
+def needs_rehash(password_hash: str) -> bool:
+    return is_legacy(password_hash) or not password_hash.startswith(f"scrypt${scrypt_n}${scrypt_r}${scrypt_p}$")
+
+# Checked when a username does not exist, with the current parameters, so
+# the reply takes as long as for a real account.
+dummy_hash = _hash_password(secrets.token_urlsafe(16))
+
+async def hash_password_async(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(executor, _hash_password, password)
+
+async def verify_password_async(password: str, password_hash: str) -> bool:
+    return await asyncio.get_running_loop().run_in_executor(executor, _verify_password, password, password_hash)
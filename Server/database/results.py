@@ -0,0 +1,186 @@
+from pymongo import UpdateOne, DESCENDING
+from pymongo.errors import BulkWriteError
+
+from database import database
+from logs import logs
+
+import asyncio
+import time
+
+logger = logs.get_logger("results")
+
+matches = database.db.get_collection("Matches")
+leaderboard = database.db.get_collection("Leaderboard")
+
+# Matches are stored with applied set to false and flipped once their
+# results are on the leaderboard. A batch that is retried after a failure
+# may already be partly stored, so duplicates are skipped on insert, and
+# what goes to the leaderboard is whatever is still unapplied.
+def insert_matches(batch: list[dict]):
+    try:
+        matches.insert_many([{ **match, "applied": False } for match in batch], ordered=False)
+    except BulkWriteError as e:
+        if any(error["code"] != 11000 for error in e.details.get("writeErrors", [])):
+            raise
+
+def unapplied_matches(batch: list[dict]) -> list[dict]:
+    game_ids = { doc["game_id"] for doc in matches.find(
+        { "game_id": { "$in": [match["game_id"] for match in batch] }, "applied": False },
+        { "_id": 0, "game_id": 1 }
+    ) }
+
+    return [match for match in batch if match["game_id"] in game_ids]
+
+# Without a transaction there is still a short window between the two
+# writes where a crash counts a game twice on retry, but a failed
+# leaderboard write no longer loses its games.
+def write_batch(batch: list[dict]):
+    insert_matches(batch)
+
+    batch = unapplied_matches(batch)
+    updates: dict[tuple[str, str, int], dict] = {}
+
+    # Results for the same player and room are folded together so each
+    # batch sends at most one update per leaderboard row.
+    for match in batch:
+        for player in match["players"]:
+            if player["uid"] is None:
+                continue
+
+            key = (player["uid"], match["channel"], match["room"])
+            update = updates.setdefault(key, { "username": player["username"], "score": 0, "games": 0, "wins": 0 })
+
+            update["username"] = player["username"]
+            update["score"] += player["score"]
+            update["games"] += 1
+            update["wins"] += int(match["winner"] == player["uid"])
+
+    if updates:
+        leaderboard.bulk_write([
+            UpdateOne(
+                { "uid": uid, "channel": channel, "room": room },
+                {
+                    "$set": { "username": update["username"] },
+                    "$inc": { "score": update["score"], "games": update["games"], "wins": update["wins"] }
+                },
+                upsert=True
+            )
+            for (uid, channel, room), update in updates.items()
+        ], ordered=False)
+
+    if batch:
+        matches.update_many({ "game_id": { "$in": [match["game_id"] for match in batch] } }, { "$set": { "applied": True } })
+
+def read_top(channel: str, room: int, limit: int) -> list[dict]:
+    return list(leaderboard.find(
+        { "channel": channel, "room": room },
+        { "_id": 0, "uid": 1, "username": 1, "score": 1, "games": 1, "wins": 1 }
+    ).sort("score", DESCENDING).limit(limit))
+
+def read_rating(uid: str, channel: str, room: int) -> dict | None:
+    return leaderboard.find_one(
+        { "uid": uid, "channel": channel, "room": room },
+        { "_id": 0, "score": 1, "games": 1 }
+    )
+
+# Finished games are queued here and written in batches, off the request
+# path. The top players of each room are re-read after a flush touches it,
+# and at least every leaderboard_ttl seconds for games written by other
+# workers.
+class ResultsPipeline:
+    def __init__(self, batch_size: int = 100, flush_interval: float = 2.0, max_pending: int = 10000, top_n: int = 10, leaderboard_ttl: float = 10.0) -> None:
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.top_n = top_n
+        self.leaderboard_ttl = leaderboard_ttl
+        self.pending: list[dict] = []
+        # (channel, room) -> (read at, rows)
+        self.leaderboards: dict[tuple[str, int], tuple[float, list[dict]]] = {}
+        self.wakeup = asyncio.Event()
+        self.lock = asyncio.Lock()
+        self.task: asyncio.Task | None = None
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+        while self.pending and await self.flush():
+            pass
+
+    def record(self, match: dict):
+        self.pending.append(match)
+
+        if len(self.pending) > self.max_pending:
+            dropped = len(self.pending) - self.max_pending
+            del self.pending[:dropped]
+            logger.warning("results_dropped", dropped=dropped)
+
+        if len(self.pending) >= self.batch_size:
+            self.wakeup.set()
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+
+            self.wakeup.clear()
+            await self.flush()
+
+    # Returns False when the batch could not be written and was requeued.
+    async def flush(self) -> bool:
+        async with self.lock:
+            if not self.pending:
+                return True
+
+            batch = self.pending[:self.batch_size]
+            del self.pending[:len(batch)]
+
+            try:
+                await database.run_in_executor(write_batch, batch)
+            except Exception:
+                logger.exception("results_write_failed", matches=len(batch))
+                self.pending[:0] = batch
+                return False
+
+            for key in { (match["channel"], match["room"]) for match in batch }:
+                await self.read_leaderboard(*key)
+
+        if len(self.pending) >= self.batch_size:
+            self.wakeup.set()
+
+        return True
+
+    async def read_leaderboard(self, channel: str, room: int) -> list[dict]:
+        rows = await database.run_in_executor(read_top, channel, room, self.top_n)
+        self.leaderboards[(channel, room)] = (time.monotonic(), rows)
+
+        return rows
+
+    async def get_leaderboard(self, channel: str, room: int) -> list[dict]:
+        cached = self.leaderboards.get((channel, room))
+
+        if cached is None or time.monotonic() - cached[0] > self.leaderboard_ttl:
+            return await self.read_leaderboard(channel, room)
+
+        return cached[1]
+
+    # The average score per game in a room, used to pair players of a
+    # similar level. Players without games there start in the middle.
+    async def get_rating(self, uid: str | None, channel: str, room: int, default: float = 50.0) -> float:
+        if uid is None:
+            return default
+
+        row = await database.run_in_executor(read_rating, uid, channel, room)
+
+        if row is None or not row.get("games"):
+            return default
+
+        return row["score"] / row["games"]
@@ -0,0 +1,12 @@
+from dictionary.dictionary import compile_words
+
+import sys
+
+# Usage: python -m dictionary.compile [words.json] [words.bin]
+if __name__ == "__main__":
+    json_path = sys.argv[1] if len(sys.argv) > 1 else "words.json"
+    bin_path = sys.argv[2] if len(sys.argv) > 2 else "words.bin"
+
+    compile_words(json_path, bin_path)
+
+    print(f"Compiled {json_path} into {bin_path}")
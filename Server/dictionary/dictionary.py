@@ -0,0 +1,244 @@
+from logs import logs
+
+import bisect
+import json
+import mmap
+import os
+import random
+import struct
+
+logger = logs.get_logger("dictionary")
+
+class WordDictionary:
+    def __init__(self, words: list[str]) -> None:
+        buckets: dict[str, dict[int, set[str]]] = {}
+
+        for word in words:
+            if not word:
+                continue
+
+            buckets.setdefault(word[0], {}).setdefault(len(word), set()).add(word)
+
+        # Words are re-bucketed by their real first letter and length, so
+        # misfiled entries in words.json still end up in the right place.
+        self.buckets: dict[str, dict[int, tuple[str, ...]]] = {
+            letter: { length: tuple(sorted(bucket)) for length, bucket in lengths.items() }
+            for letter, lengths in buckets.items()
+        }
+
+        by_length: dict[int, list[str]] = {}
+
+        for lengths in self.buckets.values():
+            for length, bucket in lengths.items():
+                by_length.setdefault(length, []).extend(bucket)
+
+        self.by_length: dict[int, tuple[str, ...]] = {
+            length: tuple(sorted(bucket)) for length, bucket in by_length.items()
+        }
+
+        self.words: frozenset[str] = frozenset(w for bucket in self.by_length.values() for w in bucket)
+
+    @classmethod
+    def from_json(cls, path: str) -> "WordDictionary":
+        with open(path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+
+        return cls([word for lengths in data.values() for bucket in lengths.values() for word in bucket])
+
+    def __contains__(self, word: object) -> bool:
+        return word in self.words
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def contains(self, word: str, length: int | None = None) -> bool:
+        if length is not None and len(word) != length:
+            return False
+
+        return word in self.words
+
+    def get_words(self, length: int, letter: str | None = None) -> tuple[str, ...]:
+        if letter is None:
+            return self.by_length.get(length, ())
+
+        return self.buckets.get(letter, {}).get(length, ())
+
+    def random_word(self, length: int, letter: str | None = None) -> str | None:
+        words = self.get_words(length, letter)
+
+        if not words:
+            return None
+
+        return random.choice(words)
+
+# Binary layout, little endian:
+#   magic "WDB1", alphabet size (H), alphabet as UTF-8 (H-prefixed),
+#   bucket count (H), then per bucket: word length (B), count (I), offset (I).
+# Each bucket is a sorted run of fixed-width records, one byte per letter
+# holding its index in the alphabet, so buckets can be binary searched
+# straight from the mapped file.
+MAGIC = b"WDB1"
+
+def compile_words(json_path: str, bin_path: str):
+    dictionary = WordDictionary.from_json(json_path)
+
+    alphabet = sorted(set("".join(dictionary.words)))
+    indexes = { letter: index for index, letter in enumerate(alphabet) }
+
+    if len(alphabet) > 255:
+        raise ValueError("Alphabet does not fit in one byte per letter")
+
+    alphabet_bytes = "".join(alphabet).encode("utf-8")
+
+    buckets = []
+
+    for length, words in sorted(dictionary.by_length.items()):
+        records = sorted(bytes(indexes[letter] for letter in word) for word in words)
+        buckets.append((length, records))
+
+    header_size = len(MAGIC) + 2 + 2 + len(alphabet_bytes) + 2 + len(buckets) * struct.calcsize("<BII")
+
+    header = bytearray(MAGIC)
+    header += struct.pack("<HH", len(alphabet), len(alphabet_bytes)) + alphabet_bytes
+    header += struct.pack("<H", len(buckets))
+
+    offset = header_size
+    data = bytearray()
+
+    for length, records in buckets:
+        header += struct.pack("<BII", length, len(records), offset)
+
+        for record in records:
+            data += record
+
+        offset += length * len(records)
+
+    with open(bin_path, "wb") as file:
+        file.write(header)
+        file.write(data)
+
+class Bucket:
+    def __init__(self, buffer: mmap.mmap, length: int, count: int, offset: int) -> None:
+        self.buffer = buffer
+        self.length = length
+        self.count = count
+        self.offset = offset
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index: int) -> bytes:
+        start = self.offset + index * self.length
+
+        return self.buffer[start:start + self.length]
+
+class MappedWordDictionary:
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.buffer[:4] != MAGIC:
+            raise ValueError(f"{path} is not a compiled word list")
+
+        # struct.error from a header cut short is reported as a ValueError
+        # like any other damage, and every bucket must end inside the file.
+        try:
+            self.read_header(path)
+        except struct.error as e:
+            raise ValueError(f"{path} has a truncated header") from e
+
+    def read_header(self, path: str):
+        alphabet_size, alphabet_bytes = struct.unpack_from("<HH", self.buffer, 4)
+        position = 8 + alphabet_bytes
+
+        self.alphabet = self.buffer[8:position].decode("utf-8")
+        self.indexes = { letter: index for index, letter in enumerate(self.alphabet) }
+
+        if len(self.alphabet) != alphabet_size:
+            raise ValueError(f"{path} has a corrupt alphabet")
+
+        (bucket_count,) = struct.unpack_from("<H", self.buffer, position)
+        position += 2
+
+        self.buckets: dict[int, Bucket] = {}
+
+        for _ in range(bucket_count):
+            length, count, offset = struct.unpack_from("<BII", self.buffer, position)
+            position += struct.calcsize("<BII")
+
+            if length == 0 or offset < position or offset + length * count > len(self.buffer):
+                raise ValueError(f"{path} is truncated")
+
+            self.buckets[length] = Bucket(self.buffer, length, count, offset)
+
+    def encode(self, word: str) -> bytes | None:
+        try:
+            return bytes(self.indexes[letter] for letter in word)
+        except KeyError:
+            return None
+
+    def decode(self, record: bytes) -> str:
+        return "".join(self.alphabet[index] for index in record)
+
+    def __contains__(self, word: object) -> bool:
+        return isinstance(word, str) and self.contains(word)
+
+    def __len__(self) -> int:
+        return sum(len(bucket) for bucket in self.buckets.values())
+
+    def contains(self, word: str, length: int | None = None) -> bool:
+        if length is not None and len(word) != length:
+            return False
+
+        bucket = self.buckets.get(len(word))
+        record = self.encode(word)
+
+        if bucket is None or record is None:
+            return False
+
+        index = bisect.bisect_left(bucket, record)
+
+        return index < len(bucket) and bucket[index] == record
+
+    def get_range(self, length: int, letter: str | None = None) -> tuple[Bucket | None, int, int]:
+        bucket = self.buckets.get(length)
+
+        if bucket is None:
+            return None, 0, 0
+
+        if letter is None:
+            return bucket, 0, len(bucket)
+
+        if letter not in self.indexes:
+            return bucket, 0, 0
+
+        prefix = self.indexes[letter]
+
+        start = bisect.bisect_left(bucket, bytes([prefix]))
+        end = bisect.bisect_left(bucket, bytes([prefix + 1]))
+
+        return bucket, start, end
+
+    def get_words(self, length: int, letter: str | None = None) -> tuple[str, ...]:
+        bucket, start, end = self.get_range(length, letter)
+
+        return tuple(self.decode(bucket[index]) for index in range(start, end))
+
+    def random_word(self, length: int, letter: str | None = None) -> str | None:
+        bucket, start, end = self.get_range(length, letter)
+
+        if start == end:
+            return None
+
+        return self.decode(bucket[random.randrange(start, end)])
+
+# Prefers the compiled word list, which worker processes share through the
+# page cache, and falls back to the JSON source when it is missing or stale.
+def load_dictionary(json_path: str, bin_path: str) -> WordDictionary | MappedWordDictionary:
+    if os.path.exists(bin_path) and os.path.getmtime(bin_path) >= os.path.getmtime(json_path):
+        try:
+            return MappedWordDictionary(bin_path)
+        except (OSError, ValueError, struct.error) as e:
+            logger.warning("word_list_unreadable", path=bin_path, fallback=json_path, error=str(e))
+
+    return WordDictionary.from_json(json_path)
@@ -0,0 +1,100 @@
+from dictionary.dictionary import MappedWordDictionary, WordDictionary, compile_words, load_dictionary
+
+import json
+import os
+import pathlib
+import pytest
+
+WORDS_JSON = pathlib.Path(__file__).resolve().parents[1] / "words.json"
+
+SAMPLE = {
+    "K": { "5": ["KALEM", "KİTAP", "KÖPEK"], "4": ["KAZA"] },
+    "A": { "5": ["ARABA", "KUZEY"], "6": ["ÇİÇEKL"] }
+}
+
+def write_sample(tmp_path: pathlib.Path) -> tuple[str, str]:
+    json_path = tmp_path / "words.json"
+    json_path.write_text(json.dumps(SAMPLE, ensure_ascii=False), encoding="utf-8")
+
+    return str(json_path), str(tmp_path / "words.bin")
+
+def test_misfiled_words_are_rebucketed(tmp_path):
+    json_path, _ = write_sample(tmp_path)
+    words = WordDictionary.from_json(json_path)
+
+    assert words.get_words(5, "K") == ("KALEM", "KUZEY", "KÖPEK", "KİTAP")
+    assert words.get_words(6, "Ç") == ("ÇİÇEKL",)
+    assert words.get_words(6, "A") == ()
+
+def test_compiled_dictionary_matches_json(tmp_path):
+    json_path, bin_path = write_sample(tmp_path)
+    compile_words(json_path, bin_path)
+
+    source = WordDictionary.from_json(json_path)
+    mapped = MappedWordDictionary(bin_path)
+
+    assert len(mapped) == len(source)
+
+    for word in source.words:
+        assert mapped.contains(word, len(word))
+        assert not mapped.contains(word, len(word) + 1)
+
+    for length in (4, 5, 6, 7):
+        assert mapped.get_words(length) == source.get_words(length)
+
+        for letter in "AKÇÖZ":
+            assert mapped.get_words(length, letter) == source.get_words(length, letter)
+
+    assert "KALEQ" not in mapped
+    assert "XXXXX" not in mapped
+    assert mapped.random_word(5, "A") == "ARABA"
+    assert mapped.random_word(7) is None
+
+def test_full_word_list_round_trips(tmp_path):
+    bin_path = str(tmp_path / "words.bin")
+    compile_words(str(WORDS_JSON), bin_path)
+
+    source = WordDictionary.from_json(str(WORDS_JSON))
+    mapped = MappedWordDictionary(bin_path)
+
+    assert len(mapped) == len(source)
+    assert all(word in mapped for word in source.words)
+
+    for length in source.by_length:
+        assert mapped.get_words(length) == source.get_words(length)
+
+def test_load_dictionary_falls_back_to_json(tmp_path):
+    json_path, bin_path = write_sample(tmp_path)
+
+    assert isinstance(load_dictionary(json_path, bin_path), WordDictionary)
+
+    compile_words(json_path, bin_path)
+
+    assert isinstance(load_dictionary(json_path, bin_path), MappedWordDictionary)
+
+    with open(bin_path, "wb") as file:
+        file.write(b"nope")
+
+    assert isinstance(load_dictionary(json_path, bin_path), WordDictionary)
+
+    os.utime(bin_path, (0, 0))
+    compile_words(json_path, bin_path)
+    os.utime(bin_path, (0, 0))
+
+    assert isinstance(load_dictionary(json_path, bin_path), WordDictionary)
+
+def test_truncated_word_list_is_rejected(tmp_path):
+    json_path, bin_path = write_sample(tmp_path)
+    compile_words(json_path, bin_path)
+
+    with open(bin_path, "rb") as file:
+        data = file.read()
+
+    for size in (6, 30, len(data) - 1):
+        with open(bin_path, "wb") as file:
+            file.write(data[:size])
+
+        with pytest.raises(ValueError):
+            MappedWordDictionary(bin_path)
+
+        assert isinstance(load_dictionary(json_path, bin_path), WordDictionary)
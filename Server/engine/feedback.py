@@ -0,0 +1,85 @@
+from collections import Counter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+ABSENT = 0
+PRESENT = 1
+CORRECT = 2
+
+STATUSES = ("absent", "present", "correct")
+
+def letter_counts(word: str) -> dict[str, int]:
+    return dict(Counter(word))
+
+# Two passes: exact matches claim their letters first, then the remaining
+# letters of the target are handed out left to right as "present".
+def score(guess: str, target: str, counts: dict[str, int] | None = None) -> list[str]:
+    remaining = dict(counts) if counts is not None else letter_counts(target)
+    statuses = ["absent"] * len(guess)
+
+    for index, (letter, expected) in enumerate(zip(guess, target)):
+        if letter == expected:
+            statuses[index] = "correct"
+            remaining[letter] -= 1
+
+    for index, letter in enumerate(guess):
+        if statuses[index] == "correct":
+            continue
+
+        if remaining.get(letter, 0) > 0:
+            statuses[index] = "present"
+            remaining[letter] -= 1
+
+    return statuses
+
+def encode_words(words: list[str], alphabet: dict[str, int]):
+    return np.array([[alphabet[letter] for letter in word] for word in words], dtype=np.int16)
+
+# Scores every guess against every target. Returns an array of shape
+# (guesses, targets, length) holding ABSENT, PRESENT or CORRECT, or nested
+# lists of the same shape when NumPy is not installed.
+def score_batch(guesses: list[str], targets: list[str]):
+    if not guesses or not targets:
+        return [] if np is None else np.zeros((len(guesses), len(targets), 0), dtype=np.int8)
+
+    length = len(guesses[0])
+
+    if any(len(word) != length for word in guesses) or any(len(word) != length for word in targets):
+        raise ValueError("All guesses and targets must have the same length")
+
+    if np is None:
+        return [
+            [[STATUSES.index(status) for status in score(guess, target)] for target in targets]
+            for guess in guesses
+        ]
+
+    letters = sorted(set("".join(guesses)) | set("".join(targets)))
+    alphabet = { letter: index for index, letter in enumerate(letters) }
+
+    g = encode_words(guesses, alphabet)
+    t = encode_words(targets, alphabet)
+
+    exact = g[:, None, :] == t[None, :, :]
+
+    # Per (guess, target) pair, how many of each letter the target still
+    # has to give out once exact matches are removed.
+    one_hot = np.zeros((len(targets), length, len(letters)), dtype=np.int16)
+    one_hot[np.arange(len(targets))[:, None], np.arange(length)[None, :], t] = 1
+    remaining = np.einsum("gtl,tla->gta", (~exact).astype(np.int16), one_hot)
+
+    result = np.where(exact, CORRECT, ABSENT).astype(np.int8)
+    rows = np.arange(len(guesses))[:, None]
+    columns = np.arange(len(targets))[None, :]
+
+    for position in range(length):
+        letter = g[:, position][:, None]
+        available = remaining[rows, columns, letter]
+        present = ~exact[:, :, position] & (available > 0)
+
+        result[:, :, position][present] = PRESENT
+        remaining[rows, columns, letter] -= present
+
+    return result
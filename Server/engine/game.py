@@ -0,0 +1,66 @@
+from dataclasses import dataclass, field
+from enum import Enum
+
+class GameStatus(Enum):
+    CREATED = "created"
+    ACCEPTED = "accepted"
+    DECLINED = "declined"
+    PLAYING = "playing"
+    FINISHED = "finished"
+    EXPIRED = "expired"
+
+TRANSITIONS: dict[GameStatus, set[GameStatus]] = {
+    GameStatus.CREATED: {GameStatus.ACCEPTED, GameStatus.DECLINED, GameStatus.EXPIRED},
+    GameStatus.ACCEPTED: {GameStatus.PLAYING, GameStatus.FINISHED, GameStatus.EXPIRED},
+    GameStatus.DECLINED: set(),
+    GameStatus.PLAYING: {GameStatus.FINISHED},
+    GameStatus.FINISHED: set(),
+    GameStatus.EXPIRED: set()
+}
+
+@dataclass(slots=True)
+class Player:
+    websocket_id: str
+    word: str | None = None
+    letter_counts: dict[str, int] | None = None
+    letter_informations: dict | None = None
+    letters_known_correctly: list[str] = field(default_factory=list)
+    letters_known_incorrectly: list[str] = field(default_factory=list)
+    score: int = 0
+    predictions_count: int = 0
+    confirm_time: float = 0.0
+    opponent: "Player | None" = field(default=None, repr=False)
+
+@dataclass(slots=True)
+class Game:
+    players: list[Player]
+    channel: str
+    room: int
+    timestamp: float
+    status: GameStatus = GameStatus.CREATED
+    seats: dict[str, Player] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.seats = { p.websocket_id: p for p in self.players }
+
+        first, second = self.players
+        first.opponent = second
+        second.opponent = first
+
+    def get_player(self, wid: str) -> Player | None:
+        return self.seats.get(wid)
+
+    def get_opponent(self, wid: str) -> Player | None:
+        player = self.seats.get(wid)
+
+        return None if player is None else player.opponent
+
+    # Moves the game to a new state, refusing anything TRANSITIONS does not
+    # allow so a late or repeated frame cannot restart or finish it twice.
+    def move(self, status: GameStatus) -> bool:
+        if status not in TRANSITIONS[self.status]:
+            return False
+
+        self.status = status
+
+        return True
@@ -0,0 +1,37 @@
+from engine import feedback
+
+import itertools
+import pytest
+
+def test_exact_matches_claim_letters_first():
+    assert feedback.score("KALEM", "KALEM") == ["correct"] * 5
+    assert feedback.score("AABBC", "ABCDE") == ["correct", "absent", "present", "absent", "present"]
+    assert feedback.score("LLAMA", "HELLO") == ["present", "present", "absent", "absent", "absent"]
+    assert feedback.score("EEEEE", "KELEM") == ["absent", "correct", "absent", "correct", "absent"]
+
+def test_score_with_precomputed_counts():
+    counts = feedback.letter_counts("KİTAP")
+
+    assert feedback.score("KAPAK", "KİTAP", counts) == feedback.score("KAPAK", "KİTAP")
+    assert counts == feedback.letter_counts("KİTAP")
+
+def test_batch_matches_scalar_scoring():
+    words = ["KALEM", "KİTAP", "KAPAK", "AABBC", "ABCDE", "LLAMA", "HELLO", "EEEEE", "ÇÖĞÜŞ", "ŞÜĞÖÇ"]
+    result = feedback.score_batch(words, words)
+
+    for (i, guess), (j, target) in itertools.product(enumerate(words), enumerate(words)):
+        expected = [feedback.STATUSES.index(status) for status in feedback.score(guess, target)]
+
+        assert list(result[i][j]) == expected
+
+def test_batch_without_numpy(monkeypatch):
+    words = ["KALEM", "KAPAK", "AABBC"]
+    expected = [[list(row) for row in rows] for rows in feedback.score_batch(words, words)]
+
+    monkeypatch.setattr(feedback, "np", None)
+
+    assert feedback.score_batch(words, words) == expected
+
+def test_batch_rejects_mixed_lengths():
+    with pytest.raises(ValueError):
+        feedback.score_batch(["KALEM"], ["KAZA"])
@@ -0,0 +1,36 @@
+from fastapi import WebSocket
+
+from gateway import encoding
+from gateway.encoding import Event
+from gateway.outbox import Outbox
+
+import asyncio
+
+class Broadcaster:
+    def __init__(self, send_timeout: float = 5.0) -> None:
+        self.send_timeout = send_timeout
+
+    def encode(self, payload: Event | dict | str) -> str:
+        return encoding.encode(payload)
+
+    async def send(self, socket: WebSocket, text: str, key: str | None = None) -> bool:
+        if isinstance(socket, Outbox):
+            socket.push(text, key)
+            return not socket.closed
+
+        try:
+            await asyncio.wait_for(socket.send_text(text), timeout=self.send_timeout)
+        except Exception:
+            return False
+
+        return True
+
+    # Returns the ids of the sockets that failed or timed out.
+    async def broadcast(self, sockets: dict[str, WebSocket], payload: Event | dict | str, key: str | None = None) -> list[str]:
+        if not sockets:
+            return []
+
+        text = self.encode(payload)
+        results = await asyncio.gather(*(self.send(socket, text, key) for socket in sockets.values()))
+
+        return [wid for wid, sent in zip(sockets.keys(), results) if not sent]
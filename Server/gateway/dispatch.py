@@ -0,0 +1,111 @@
+from pydantic import BaseModel, ConfigDict, ValidationError
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+from gateway import ratelimit
+from gateway.ratelimit import Limit
+
+MALFORMED = "malformed"
+UNKNOWN_OP = "unknown_op"
+INVALID_PAYLOAD = "invalid_payload"
+FAILED = "failed"
+RATE_LIMITED = "rate_limited"
+
+# Schemas only check the shape of a frame. Validators are built once when
+# the class is defined, and strict mode keeps "5" from passing as a room.
+class Schema(BaseModel):
+    model_config = ConfigDict(strict=True)
+
+class Empty(Schema):
+    pass
+
+class JoinRoom(Schema):
+    channel: str
+    room: int
+    version: int | None = None
+    epoch: str | None = None
+
+class SyncRoom(Schema):
+    version: int | None = None
+    epoch: str | None = None
+
+class GameRequest(Schema):
+    uid: str
+
+class GameReference(Schema):
+    game_id: str
+
+class ConfirmWord(Schema):
+    game_id: str
+    word: str
+
+class CheckWord(Schema):
+    word: str
+
+class FrameError(Exception):
+    def __init__(self, op: int | None, reason: str, fields: list[str] | None = None) -> None:
+        super().__init__(reason)
+        self.op = op
+        self.reason = reason
+        self.fields = fields or []
+
+    def to_event(self) -> dict:
+        d = { "op": self.op, "reason": self.reason }
+
+        if self.fields:
+            d["fields"] = self.fields
+
+        return { "op": 0, "d": d, "t": "INVALID_FRAME" }
+
+@dataclass(slots=True)
+class Route:
+    op: int
+    event: str
+    handler: Callable[[str, dict], Awaitable[None]]
+    schema: type[Schema] = Empty
+    # Frames for a game hosted on another worker are sent on to it.
+    forwarded: bool = False
+    # Keys of the payload written to the log along with the event.
+    fields: tuple[str, ...] = ()
+    logged: bool = True
+    limit: Limit | None = None
+
+class Dispatcher:
+    def __init__(self) -> None:
+        self.routes: dict[int, Route] = {}
+
+    def __contains__(self, op) -> bool:
+        return isinstance(op, int) and op in self.routes
+
+    # Limits set in RATE_LIMITS take the place of the ones given here.
+    def route(self, op: int, event: str, handler: Callable[[str, dict], Awaitable[None]], schema: type[Schema] = Empty, forwarded: bool = False, fields: tuple[str, ...] = (), logged: bool = True, limit: Limit | None = None):
+        self.routes[op] = Route(op, event, handler, schema, forwarded, fields, logged, ratelimit.overrides.get(event, limit))
+
+    # Returns the route and the validated payload data, or raises FrameError
+    # with the reason the frame was refused.
+    def parse(self, payload) -> tuple[Route, dict]:
+        if not isinstance(payload, dict) or "op" not in payload:
+            raise FrameError(None, MALFORMED)
+
+        op = payload["op"]
+
+        if op not in self:
+            raise FrameError(op if isinstance(op, int) else None, UNKNOWN_OP)
+
+        route = self.routes[op]
+        data = payload.get("d")
+
+        if data is None:
+            data = {}
+
+        if not isinstance(data, dict):
+            raise FrameError(op, INVALID_PAYLOAD, ["d"])
+
+        try:
+            frame = route.schema.model_validate(data)
+        except ValidationError as e:
+            raise FrameError(op, INVALID_PAYLOAD, [".".join(str(part) for part in error["loc"]) for error in e.errors()])
+
+        # Handlers get the validated fields only, with optional fields that
+        # were left out or null dropped.
+        return route, frame.model_dump(exclude_none=True)
@@ -0,0 +1,72 @@
+from dataclasses import dataclass
+from typing import Any
+
+import json
+
+# The fastest available serializer is picked once at import time. Every
+# backend produces compact UTF-8 text, which is what the clients parse.
+try:
+    import orjson
+
+    backend = "orjson"
+
+    DecodeError = orjson.JSONDecodeError
+
+    def dumps(obj: Any) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+    def loads(data: str | bytes) -> Any:
+        return orjson.loads(data)
+except ImportError:
+    try:
+        import msgspec
+
+        backend = "msgspec"
+
+        DecodeError = msgspec.DecodeError
+
+        _encoder = msgspec.json.Encoder()
+        _decoder = msgspec.json.Decoder()
+
+        def dumps(obj: Any) -> str:
+            return _encoder.encode(obj).decode("utf-8")
+
+        def loads(data: str | bytes) -> Any:
+            return _decoder.decode(data)
+    except ImportError:
+        backend = "json"
+
+        DecodeError = json.JSONDecodeError
+
+        def dumps(obj: Any) -> str:
+            return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+        def loads(data: str | bytes) -> Any:
+            return json.loads(data)
+
+@dataclass(slots=True)
+class Event:
+    op: int
+    d: Any = None
+    t: str | None = None
+
+    def to_dict(self) -> dict:
+        payload = { "op": self.op }
+
+        if self.d is not None:
+            payload["d"] = self.d
+
+        if self.t is not None:
+            payload["t"] = self.t
+
+        return payload
+
+# Already encoded text is passed through so one encoding can be reused.
+def encode(payload: Event | dict | str) -> str:
+    if isinstance(payload, str):
+        return payload
+
+    if isinstance(payload, Event):
+        payload = payload.to_dict()
+
+    return dumps(payload)
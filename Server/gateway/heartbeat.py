@@ -0,0 +1,75 @@
+from typing import Awaitable, Callable
+
+from logs import logs
+
+import asyncio
+import heapq
+import time
+
+logger = logs.get_logger("heartbeat")
+
+class HeartbeatScheduler:
+    def __init__(self, interval: float, on_expire: Callable[[list[str]], Awaitable[None]], tick: float = 1.0) -> None:
+        self.interval = interval
+        self.on_expire = on_expire
+        self.tick = tick
+        self.last_seen: dict[str, float] = {}
+        self.deadlines: list[tuple[float, str]] = []
+        self.task: asyncio.Task | None = None
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def track(self, wid: str):
+        now = time.monotonic()
+
+        self.last_seen[wid] = now
+        heapq.heappush(self.deadlines, (now + self.interval, wid))
+
+    # Beats only touch the dict; the heap entry is pushed forward lazily
+    # when its old deadline comes up.
+    def beat(self, wid: str):
+        if wid in self.last_seen:
+            self.last_seen[wid] = time.monotonic()
+
+    def untrack(self, wid: str):
+        self.last_seen.pop(wid, None)
+
+    def expire(self, now: float) -> list[str]:
+        expired = []
+
+        while self.deadlines and self.deadlines[0][0] <= now:
+            _, wid = heapq.heappop(self.deadlines)
+            last_seen = self.last_seen.get(wid)
+
+            if last_seen is None:
+                continue
+
+            if last_seen + self.interval > now:
+                heapq.heappush(self.deadlines, (last_seen + self.interval, wid))
+                continue
+
+            del self.last_seen[wid]
+            expired.append(wid)
+
+        return expired
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+
+            expired = self.expire(time.monotonic())
+
+            if not expired:
+                continue
+
+            try:
+                await self.on_expire(expired)
+            except Exception:
+                logger.exception("expire_failed", sessions=len(expired))
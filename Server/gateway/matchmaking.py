@@ -0,0 +1,174 @@
+from typing import Awaitable, Callable
+
+from logs import logs
+
+import asyncio
+import bisect
+import time
+
+logger = logs.get_logger("matchmaking")
+
+Entry = tuple[float, float, str]
+
+class MatchQueue:
+    def __init__(self) -> None:
+        # (rating, queued at, wid), sorted by rating so the closest opponent
+        # is found with a binary search. Inserting into and deleting from a
+        # plain list shifts the entries after it, so those are O(n), but as
+        # one memmove of pointers that stays cheaper than a tree up to queues
+        # far larger than one room gets.
+        self.entries: list[Entry] = []
+        # The same entries by the time they were queued.
+        self.waiting: dict[str, Entry] = {}
+        # False once an entry was pushed out of order, e.g. a requeued
+        # player keeping their old place.
+        self.ordered = True
+
+    def __len__(self) -> int:
+        return len(self.waiting)
+
+    def __contains__(self, wid: str) -> bool:
+        return wid in self.waiting
+
+    def push(self, entry: Entry) -> bool:
+        if entry[2] in self.waiting:
+            return False
+
+        bisect.insort(self.entries, entry)
+
+        if self.waiting and entry[1] < next(reversed(self.waiting.values()))[1]:
+            self.ordered = False
+
+        self.waiting[entry[2]] = entry
+
+        return True
+
+    def remove(self, wid: str) -> Entry | None:
+        entry = self.waiting.pop(wid, None)
+
+        if entry is not None:
+            del self.entries[bisect.bisect_left(self.entries, entry)]
+
+        return entry
+
+    def closest(self, entry: Entry) -> Entry | None:
+        index = bisect.bisect_left(self.entries, entry)
+        best = None
+
+        for neighbour in (index - 1, index + 1):
+            if 0 <= neighbour < len(self.entries):
+                candidate = self.entries[neighbour]
+
+                if best is None or abs(candidate[0] - entry[0]) < abs(best[0] - entry[0]):
+                    best = candidate
+
+        return best
+
+    # Players are matched longest waiting first with their closest rating,
+    # as long as the gap fits in a window that widens while they wait.
+    def pair(self, now: float, window: float, growth: float) -> list[tuple[Entry, Entry]]:
+        pairs = []
+
+        if not self.ordered:
+            self.waiting = { entry[2]: entry for entry in sorted(self.waiting.values(), key=lambda entry: entry[1]) }
+            self.ordered = True
+
+        for entry in list(self.waiting.values()):
+            if entry[2] not in self.waiting:
+                continue
+
+            opponent = self.closest(entry)
+
+            if opponent is None:
+                break
+
+            if abs(opponent[0] - entry[0]) > window + growth * (now - entry[1]):
+                continue
+
+            self.remove(entry[2])
+            self.remove(opponent[2])
+
+            pairs.append((entry, opponent))
+
+        return pairs
+
+class Matchmaker:
+    def __init__(self, on_match: Callable[[str, int, list[tuple[Entry, Entry]]], Awaitable[None]], tick: float = 1.0, window: float = 10.0, growth: float = 5.0) -> None:
+        self.on_match = on_match
+        self.tick = tick
+        self.window = window
+        self.growth = growth
+        self.queues: dict[tuple[str, int], MatchQueue] = {}
+        self.rooms: dict[str, tuple[str, int]] = {}
+        self.task: asyncio.Task | None = None
+
+    def __contains__(self, wid: str) -> bool:
+        return wid in self.rooms
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def size(self, channel: str, room: int) -> int:
+        queue = self.queues.get((channel, room))
+
+        return 0 if queue is None else len(queue)
+
+    def enqueue(self, wid: str, channel: str, room: int, rating: float, queued_at: float | None = None) -> bool:
+        if wid in self.rooms:
+            return False
+
+        if queued_at is None:
+            queued_at = time.monotonic()
+
+        self.queues.setdefault((channel, room), MatchQueue()).push((rating, queued_at, wid))
+        self.rooms[wid] = (channel, room)
+
+        return True
+
+    def dequeue(self, wid: str) -> bool:
+        key = self.rooms.pop(wid, None)
+
+        if key is None:
+            return False
+
+        self.queues[key].remove(wid)
+
+        return True
+
+    # Requeues a player whose opponent dropped out, keeping their place.
+    def requeue(self, channel: str, room: int, entry: Entry):
+        self.enqueue(entry[2], channel, room, entry[0], entry[1])
+
+    def match(self, now: float) -> list[tuple[str, int, list[tuple[Entry, Entry]]]]:
+        matches = []
+
+        for (channel, room), queue in self.queues.items():
+            if len(queue) < 2:
+                continue
+
+            pairs = queue.pair(now, self.window, self.growth)
+
+            for entry, opponent in pairs:
+                del self.rooms[entry[2]]
+                del self.rooms[opponent[2]]
+
+            if pairs:
+                matches.append((channel, room, pairs))
+
+        return matches
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+
+            for channel, room, pairs in self.match(time.monotonic()):
+                try:
+                    await self.on_match(channel, room, pairs)
+                except Exception:
+                    logger.exception("match_failed", channel=channel, room=room, pairs=len(pairs))
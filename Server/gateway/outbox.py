@@ -0,0 +1,192 @@
+from collections import deque
+from fastapi import WebSocket
+
+import asyncio
+
+DROP_OLDEST = "drop_oldest"
+DISCONNECT = "disconnect"
+
+# Counters shared by every outbox of a manager.
+class OutboxStats:
+    def __init__(self) -> None:
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.overflows = 0
+        self.failed = 0
+
+# Owns all writes to one socket. Handlers only queue frames, and a writer
+# task sends them, so a slow client cannot hold up whoever is sending to it.
+class Outbox:
+    def __init__(self, socket: WebSocket, stats: OutboxStats, size: int = 256, policy: str = DISCONNECT, send_timeout: float = 5.0) -> None:
+        self.socket = socket
+        self.stats = stats
+        self.size = size
+        self.policy = policy
+        self.send_timeout = send_timeout
+        # [key, text] pairs. A superseded entry has its text cleared and is
+        # skipped by the writer.
+        self.queue: deque[list] = deque()
+        self.pending: dict[str, list] = {}
+        # The frame the writer is sending, put back at the front if the
+        # outbox is aborted before the send completes.
+        self.sending: str | None = None
+        self.depth = 0
+        self.high_water = 0
+        self.wakeup = asyncio.Event()
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.closed = False
+        self.task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return self.depth
+
+    async def receive_text(self) -> str:
+        return await self.socket.receive_text()
+
+    async def send_text(self, text: str):
+        self.push(text)
+
+    # Frames with the same key replace each other while still queued, and
+    # the newest one is moved to the back so the order of events holds.
+    # Once the outbox is aborted nothing is written, but frames are still
+    # queued, oldest dropped first, so they can be handed to a replay
+    # buffer when the session is suspended.
+    def push(self, text: str, key: str | None = None):
+        if key is not None:
+            entry = self.pending.pop(key, None)
+
+            if entry is not None:
+                entry[1] = None
+                self.depth -= 1
+                self.stats.coalesced += 1
+
+        if self.depth >= self.size:
+            self.stats.overflows += 1
+
+            if self.policy == DISCONNECT and not self.closed:
+                self.abort()
+            else:
+                self.drop_oldest()
+
+        entry = [key, text]
+
+        self.queue.append(entry)
+        self.depth += 1
+        self.high_water = max(self.high_water, self.depth)
+
+        if key is not None:
+            self.pending[key] = entry
+
+        if self.closed:
+            return
+
+        self.wakeup.set()
+        self.idle.clear()
+
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+
+    def pop(self) -> str | None:
+        while self.queue:
+            key, text = self.queue.popleft()
+
+            if text is None:
+                continue
+
+            if key is not None:
+                self.pending.pop(key, None)
+
+            self.depth -= 1
+
+            return text
+
+        return None
+
+    def drop_oldest(self):
+        if self.pop() is not None:
+            self.stats.dropped += 1
+
+    def drain(self) -> list[str]:
+        frames = []
+
+        while (text := self.pop()) is not None:
+            frames.append(text)
+
+        return frames
+
+    async def run(self):
+        while not self.closed:
+            text = self.pop()
+
+            if text is None:
+                self.idle.set()
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            # A send that takes too long aborts the outbox, which cancels
+            # this task, rather than wrapping every send in wait_for.
+            handle = asyncio.get_running_loop().call_later(self.send_timeout, self.fail)
+            self.sending = text
+
+            try:
+                await self.socket.send_text(text)
+            except Exception:
+                self.fail()
+                return
+            finally:
+                handle.cancel()
+
+            self.sending = None
+            self.stats.sent += 1
+
+    def fail(self):
+        if not self.closed:
+            self.stats.failed += 1
+
+        self.abort()
+
+    # Closing the socket ends its receive loop, which then drops the
+    # session the same way as when the client goes away.
+    def abort(self):
+        if self.closed:
+            return
+
+        self.closed = True
+        self.wakeup.set()
+
+        # The client may not have got it, and the replay buffer is where it
+        # has a chance of arriving.
+        if self.sending is not None:
+            self.queue.appendleft([None, self.sending])
+            self.depth += 1
+            self.sending = None
+
+        if self.task is not None and self.task is not asyncio.current_task():
+            self.task.cancel()
+
+        asyncio.ensure_future(self.close_socket())
+
+    async def close_socket(self):
+        try:
+            await asyncio.wait_for(self.socket.close(), timeout=self.send_timeout)
+        except Exception:
+            pass
+
+    # Sends what is still queued, for at most send_timeout, then closes.
+    async def close(self):
+        if self.closed:
+            return
+
+        if self.task is not None:
+            try:
+                await asyncio.wait_for(self.idle.wait(), timeout=self.send_timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        self.closed = True
+        self.wakeup.set()
+
+        await self.close_socket()
@@ -0,0 +1,56 @@
+from dotenv import load_dotenv
+from dataclasses import dataclass
+
+import os
+
+load_dotenv()
+
+# (tokens per second, burst)
+Limit = tuple[float, float]
+
+# Key of the bucket every frame of a connection is taken from.
+ANY = -1
+
+# "name=rate/burst" pairs, e.g. "game_request=0.5/3,frames=20/40". Names are
+# route events, and "frames" is the limit over all frames of a connection.
+def parse_limits(value: str) -> dict[str, Limit]:
+    limits = {}
+
+    for pair in value.split(","):
+        if "=" not in pair or "/" not in pair:
+            continue
+
+        name, limit = pair.split("=", 1)
+        rate, burst = limit.split("/", 1)
+        limits[name.strip()] = (float(rate), float(burst))
+
+    return limits
+
+overrides = parse_limits(os.getenv("RATE_LIMITS", ""))
+
+@dataclass(slots=True)
+class TokenBucket:
+    rate: float
+    burst: float
+    tokens: float
+    updated: float
+
+    def take(self, now: float) -> bool:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens < 1.0:
+            return False
+
+        self.tokens -= 1.0
+
+        return True
+
+# Buckets are created full the first time a key is used.
+def allow(buckets: dict[int, TokenBucket], key: int, limit: Limit, now: float) -> bool:
+    bucket = buckets.get(key)
+
+    if bucket is None:
+        bucket = buckets[key] = TokenBucket(limit[0], limit[1], limit[1], now)
+
+    return bucket.take(now)
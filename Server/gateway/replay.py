@@ -0,0 +1,26 @@
+from collections import deque
+
+# Stands in for the socket of a session that dropped and may still resume.
+# Frames sent to it are kept, up to a limit, and replayed on resume.
+class ReplayBuffer:
+    def __init__(self, size: int = 64) -> None:
+        self.frames: deque[str] = deque(maxlen=size)
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    async def send_text(self, text: str):
+        if len(self.frames) == self.frames.maxlen:
+            self.dropped += 1
+
+        self.frames.append(text)
+
+    async def close(self):
+        pass
+
+    def drain(self) -> list[str]:
+        frames = list(self.frames)
+        self.frames.clear()
+
+        return frames
@@ -0,0 +1,147 @@
+from collections import deque
+
+from gateway import encoding
+
+import uuid
+
+# Room events that only carry the latest state of their users, so a queued
+# one can be replaced by a newer one for the same users.
+#
+# Versions seen by a client can therefore jump: the replaced event's
+# version is never delivered. The frame that replaced it carries the later
+# version and the state that supersedes it, so the client is still in step
+# at that version. Clients must treat a gap as normal, not as lost events,
+# and only send their last version back with op 3 or op 13.
+def coalesce_key(event: dict) -> str | None:
+    if event.get("t") != "STATUS_UPDATE":
+        return None
+
+    return "STATUS_UPDATE:" + ",".join(user["uid"] for user in event["d"]["users"])
+
+class Room:
+    def __init__(self, history: int = 256) -> None:
+        # Local sockets in the room, in join order.
+        self.members: dict[str, None] = {}
+        # Every user in the room across workers, kept up to date from the
+        # same events that are broadcast to the clients.
+        self.roster: dict[str, dict] = {}
+        self.fragments: dict[str, str] = {}
+        self.frame: str | None = None
+        # Versions are local to this replica, so clients also get the epoch
+        # and anything from another epoch is answered with a full snapshot.
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self.history: deque[dict] = deque(maxlen=history)
+
+    def __len__(self) -> int:
+        return len(self.roster)
+
+    def add_member(self, wid: str):
+        self.members[wid] = None
+
+    def remove_member(self, wid: str):
+        self.members.pop(wid, None)
+
+    def add_user(self, user: dict) -> bool:
+        record = {
+            "uid": user["uid"],
+            "username": user["username"],
+            "status": user["status"]
+        }
+
+        if self.roster.get(record["uid"]) == record:
+            return False
+
+        self.roster[record["uid"]] = record
+        self.fragments[record["uid"]] = encoding.dumps(record)
+        self.frame = None
+
+        return True
+
+    def remove_user(self, uid: str) -> bool:
+        if self.roster.pop(uid, None) is None:
+            return False
+
+        del self.fragments[uid]
+        self.frame = None
+
+        return True
+
+    def update_status(self, uid: str, status: int) -> bool:
+        record = self.roster.get(uid)
+
+        if record is None or record["status"] == status:
+            return False
+
+        record["status"] = status
+        self.fragments[uid] = encoding.dumps(record)
+        self.frame = None
+
+        return True
+
+    # Applies a room event to the roster and returns it stamped with the
+    # resulting version.
+    def apply(self, event: dict) -> dict:
+        t = event.get("t")
+        changed = False
+
+        if t == "USER_JOIN_ROOM":
+            changed = self.add_user(event["d"]["user"])
+        elif t == "USER_LEAVE_ROOM":
+            changed = self.remove_user(event["d"]["user"]["uid"])
+        elif t == "STATUS_UPDATE":
+            for user in event["d"]["users"]:
+                changed = self.update_status(user["uid"], user["status"]) or changed
+
+        if changed:
+            self.version += 1
+
+        event = { **event, "d": { **event["d"], "version": self.version } }
+
+        if changed:
+            self.history.append(event)
+
+        return event
+
+    def changes_since(self, version: int, epoch: str) -> list[dict] | None:
+        if epoch != self.epoch or version > self.version:
+            return None
+
+        if version == self.version:
+            return []
+
+        if not self.history or self.history[0]["d"]["version"] > version + 1:
+            return None
+
+        return [
+            { "t": event["t"], "d": event["d"] }
+            for event in self.history
+            if event["d"]["version"] > version
+        ]
+
+    # The user list is stitched together from per-user fragments and cached
+    # until the roster changes again.
+    def snapshot(self) -> str:
+        if self.frame is None:
+            self.frame = '{"op":0,"d":{"users":[' + ",".join(self.fragments.values()) + ']'
+
+        return self.frame
+
+    # A snapshot taken before a user's own join is sent with the version
+    # that includes it, so the joining client starts in step.
+    def join_frame(self, snapshot: str | None = None) -> str:
+        if snapshot is None:
+            snapshot = self.snapshot()
+
+        return snapshot + f',"version":{self.version},"epoch":"{self.epoch}"' + '},"t":"JOIN_ROOM"}'
+
+    def delta_frame(self, changes: list[dict]) -> dict:
+        return {
+            "op": 0,
+            "d": {
+                "version": self.version,
+                "epoch": self.epoch,
+                "changes": changes
+            },
+            "t": "ROOM_DELTA"
+        }
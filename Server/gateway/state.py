@@ -0,0 +1,267 @@
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable
+
+from gateway import encoding
+
+import asyncio
+import os
+
+Handler = Callable[[str, dict], Awaitable[None]]
+
+def worker_topic(worker: str) -> str:
+    return f"worker:{worker}"
+
+def room_topic(channel: str, room: int) -> str:
+    return f"room:{channel}:{room}"
+
+# Every worker listens here for tokens revoked on any of them.
+REVOKED = "revoked"
+
+# Room membership, user presence, game ownership and cross-worker messages
+# live behind this interface so several gateway processes can share them.
+class StateBackend(ABC):
+    @abstractmethod
+    async def add_member(self, channel: str, room: int, wid: str):
+        ...
+
+    @abstractmethod
+    async def remove_member(self, channel: str, room: int, wid: str):
+        ...
+
+    @abstractmethod
+    async def get_members(self, channel: str, room: int) -> list[dict]:
+        ...
+
+    @abstractmethod
+    async def set_user(self, wid: str, record: dict):
+        ...
+
+    @abstractmethod
+    async def get_user(self, wid: str) -> dict | None:
+        ...
+
+    @abstractmethod
+    async def delete_user(self, wid: str):
+        ...
+
+    @abstractmethod
+    async def set_game(self, game_id: str, worker: str):
+        ...
+
+    @abstractmethod
+    async def get_game(self, game_id: str) -> str | None:
+        ...
+
+    @abstractmethod
+    async def delete_game(self, game_id: str):
+        ...
+
+    # Called periodically by each worker for the users and games it holds,
+    # so records left behind by a worker that died expire on their own.
+    @abstractmethod
+    async def refresh(self, wids: list[str], game_ids: list[str]):
+        ...
+
+    @abstractmethod
+    async def publish(self, topic: str, message: dict):
+        ...
+
+    @abstractmethod
+    async def subscribe(self, topics: list[str], handler: Handler):
+        ...
+
+    async def close(self):
+        pass
+
+class MemoryBackend(StateBackend):
+    def __init__(self) -> None:
+        self.rooms: dict[tuple[str, int], dict[str, None]] = {}
+        self.users: dict[str, dict] = {}
+        self.games: dict[str, str] = {}
+        self.handlers: dict[str, list[Handler]] = {}
+
+    async def add_member(self, channel: str, room: int, wid: str):
+        self.rooms.setdefault((channel, room), {})[wid] = None
+
+    async def remove_member(self, channel: str, room: int, wid: str):
+        self.rooms.get((channel, room), {}).pop(wid, None)
+
+    async def get_members(self, channel: str, room: int) -> list[dict]:
+        members = []
+
+        for wid in self.rooms.get((channel, room), {}):
+            record = self.users.get(wid)
+
+            if record is not None:
+                members.append({ "uid": wid, **record })
+
+        return members
+
+    async def set_user(self, wid: str, record: dict):
+        self.users[wid] = record
+
+    async def get_user(self, wid: str) -> dict | None:
+        return self.users.get(wid)
+
+    async def delete_user(self, wid: str):
+        self.users.pop(wid, None)
+
+    async def set_game(self, game_id: str, worker: str):
+        self.games[game_id] = worker
+
+    async def get_game(self, game_id: str) -> str | None:
+        return self.games.get(game_id)
+
+    async def delete_game(self, game_id: str):
+        self.games.pop(game_id, None)
+
+    async def refresh(self, wids: list[str], game_ids: list[str]):
+        pass
+
+    async def publish(self, topic: str, message: dict):
+        for handler in self.handlers.get(topic, []):
+            asyncio.ensure_future(handler(topic, message))
+
+    async def subscribe(self, topics: list[str], handler: Handler):
+        for topic in topics:
+            self.handlers.setdefault(topic, []).append(handler)
+
+# Works against Redis or any server speaking its protocol (KeyDB, Dragonfly,
+# a local redis-server, ...). redis-py is only needed when this is selected.
+# User and game keys expire after ttl seconds unless the worker holding them
+# refreshes them, and room members whose user key is gone are dropped when
+# the room is read.
+class RedisBackend(StateBackend):
+    def __init__(self, url: str, prefix: str = "wordle", ttl: int = 60) -> None:
+        import redis.asyncio as redis
+
+        self.redis = redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.ttl = ttl
+        self.pubsub = None
+        self.listener: asyncio.Task | None = None
+        self.handlers: dict[str, list[Handler]] = {}
+
+    def key(self, *parts) -> str:
+        return ":".join([self.prefix, *map(str, parts)])
+
+    async def add_member(self, channel: str, room: int, wid: str):
+        sequence = await self.redis.incr(self.key("sequence"))
+
+        await self.redis.zadd(self.key("room", channel, room), { wid: sequence })
+
+    async def remove_member(self, channel: str, room: int, wid: str):
+        await self.redis.zrem(self.key("room", channel, room), wid)
+
+    async def get_members(self, channel: str, room: int) -> list[dict]:
+        wids = await self.redis.zrange(self.key("room", channel, room), 0, -1)
+
+        if not wids:
+            return []
+
+        records = await self.redis.mget([self.key("user", wid) for wid in wids])
+        expired = [wid for wid, record in zip(wids, records) if record is None]
+
+        if expired:
+            await self.redis.zrem(self.key("room", channel, room), *expired)
+
+        return [
+            { "uid": wid, **encoding.loads(record) }
+            for wid, record in zip(wids, records)
+            if record is not None
+        ]
+
+    async def set_user(self, wid: str, record: dict):
+        await self.redis.set(self.key("user", wid), encoding.dumps(record), ex=self.ttl)
+
+    async def get_user(self, wid: str) -> dict | None:
+        record = await self.redis.get(self.key("user", wid))
+
+        if record is None:
+            return None
+
+        return encoding.loads(record)
+
+    async def delete_user(self, wid: str):
+        await self.redis.delete(self.key("user", wid))
+
+    async def set_game(self, game_id: str, worker: str):
+        await self.redis.set(self.key("game", game_id), worker, ex=self.ttl)
+
+    async def get_game(self, game_id: str) -> str | None:
+        return await self.redis.get(self.key("game", game_id))
+
+    async def delete_game(self, game_id: str):
+        await self.redis.delete(self.key("game", game_id))
+
+    async def refresh(self, wids: list[str], game_ids: list[str]):
+        if not wids and not game_ids:
+            return
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for wid in wids:
+                pipe.expire(self.key("user", wid), self.ttl)
+
+            for game_id in game_ids:
+                pipe.expire(self.key("game", game_id), self.ttl)
+
+            await pipe.execute()
+
+    async def publish(self, topic: str, message: dict):
+        await self.redis.publish(self.key("topic", topic), encoding.dumps(message))
+
+    async def subscribe(self, topics: list[str], handler: Handler):
+        if self.pubsub is None:
+            self.pubsub = self.redis.pubsub()
+
+        for topic in topics:
+            self.handlers.setdefault(topic, []).append(handler)
+
+        await self.pubsub.subscribe(*[self.key("topic", topic) for topic in topics])
+
+        if self.listener is None:
+            self.listener = asyncio.ensure_future(self.listen())
+
+    async def listen(self):
+        prefix = self.key("topic", "")
+
+        async for message in self.pubsub.listen():
+            if message["type"] != "message":
+                continue
+
+            topic = message["channel"][len(prefix):]
+            data = encoding.loads(message["data"])
+
+            for handler in self.handlers.get(topic, []):
+                asyncio.ensure_future(handler(topic, data))
+
+    async def close(self):
+        if self.listener is not None:
+            self.listener.cancel()
+
+        if self.pubsub is not None:
+            await self.pubsub.aclose()
+
+        await self.redis.aclose()
+
+# Stands in for the socket of a user connected to another worker; frames are
+# routed to that worker, which writes them to the real socket.
+class RemoteSocket:
+    def __init__(self, backend: StateBackend, worker: str, wid: str) -> None:
+        self.backend = backend
+        self.worker = worker
+        self.wid = wid
+
+    async def send_text(self, text: str):
+        await self.backend.publish(worker_topic(self.worker), { "kind": "deliver", "wids": [self.wid], "text": text })
+
+    async def close(self):
+        await self.backend.publish(worker_topic(self.worker), { "kind": "close", "wid": self.wid })
+
+def create_backend() -> StateBackend:
+    backend = os.getenv("STATE_BACKEND", "memory")
+
+    if backend == "redis":
+        return RedisBackend(os.getenv("REDIS_URL", "redis://localhost:6379/0"), ttl=int(os.getenv("STATE_TTL", "60")))
+
+    return MemoryBackend()
@@ -0,0 +1,70 @@
+from typing import Awaitable, Callable
+
+from logs import logs
+
+import asyncio
+import heapq
+import time
+
+logger = logs.get_logger("sweeper")
+
+class ExpirySweeper:
+    def __init__(self, get_deadline: Callable[[str], float | None], on_expire: Callable[[list[str]], Awaitable[None]], tick: float = 5.0) -> None:
+        self.get_deadline = get_deadline
+        self.on_expire = on_expire
+        self.tick = tick
+        self.deadlines: list[tuple[float, str]] = []
+        self.task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self.deadlines)
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def track(self, key: str):
+        deadline = self.get_deadline(key)
+
+        if deadline is not None:
+            heapq.heappush(self.deadlines, (deadline, key))
+
+    # Deadlines are looked up again when they come due, so keys that moved
+    # on are dropped and keys whose deadline was pushed back are requeued
+    # without having to touch the heap when that happened.
+    def expire(self, now: float) -> list[str]:
+        expired = []
+
+        while self.deadlines and self.deadlines[0][0] <= now:
+            _, key = heapq.heappop(self.deadlines)
+            deadline = self.get_deadline(key)
+
+            if deadline is None:
+                continue
+
+            if deadline > now:
+                heapq.heappush(self.deadlines, (deadline, key))
+                continue
+
+            expired.append(key)
+
+        return expired
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+
+            expired = self.expire(time.time())
+
+            if not expired:
+                continue
+
+            try:
+                await self.on_expire(expired)
+            except Exception:
+                logger.exception("expire_failed", games=len(expired))
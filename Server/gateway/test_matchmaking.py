@@ -0,0 +1,73 @@
+from gateway.matchmaking import Matchmaker, MatchQueue
+
+async def ignore(channel, room, pairs):
+    pass
+
+def test_queue_keeps_entries_sorted_by_rating():
+    queue = MatchQueue()
+
+    for entry in [(60.0, 1.0, "a"), (20.0, 2.0, "b"), (40.0, 3.0, "c")]:
+        assert queue.push(entry)
+
+    assert not queue.push((10.0, 4.0, "a"))
+    assert [entry[2] for entry in queue.entries] == ["b", "c", "a"]
+    assert queue.remove("c") == (40.0, 3.0, "c")
+    assert queue.remove("c") is None
+    assert "c" not in queue and len(queue) == 2
+
+def test_closest_rating_is_paired_longest_waiting_first():
+    queue = MatchQueue()
+
+    queue.push((50.0, 0.0, "a"))
+    queue.push((90.0, 1.0, "b"))
+    queue.push((55.0, 2.0, "c"))
+    queue.push((85.0, 3.0, "d"))
+
+    pairs = queue.pair(now=3.0, window=10.0, growth=0.0)
+
+    assert [(x[2], y[2]) for x, y in pairs] == [("a", "c"), ("b", "d")]
+    assert len(queue) == 0
+
+def test_window_widens_while_waiting():
+    queue = MatchQueue()
+
+    queue.push((20.0, 0.0, "a"))
+    queue.push((80.0, 0.0, "b"))
+
+    assert queue.pair(now=1.0, window=10.0, growth=5.0) == []
+    assert len(queue.pair(now=10.0, window=10.0, growth=5.0)) == 1
+
+def test_matchmaker_tracks_rooms():
+    matchmaker = Matchmaker(ignore)
+
+    assert matchmaker.enqueue("a", "harfli", 5, 50.0, 0.0)
+    assert not matchmaker.enqueue("a", "harfli", 5, 50.0, 0.0)
+    assert matchmaker.enqueue("b", "harfli", 5, 52.0, 1.0)
+    assert matchmaker.enqueue("c", "harfsiz", 5, 51.0, 1.0)
+
+    matches = matchmaker.match(2.0)
+
+    assert [(channel, room, [(x[2], y[2]) for x, y in pairs]) for channel, room, pairs in matches] == [("harfli", 5, [("a", "b")])]
+    assert "a" not in matchmaker and "c" in matchmaker
+    assert matchmaker.dequeue("c") and not matchmaker.dequeue("c")
+    assert matchmaker.size("harfsiz", 5) == 0
+
+    matchmaker.requeue("harfli", 5, (50.0, 0.0, "a"))
+
+    assert matchmaker.queues[("harfli", 5)].waiting["a"] == (50.0, 0.0, "a")
+
+def test_requeued_player_keeps_their_place():
+    matchmaker = Matchmaker(ignore, window=100.0)
+
+    matchmaker.enqueue("b", "harfli", 5, 10.0, 5.0)
+    matchmaker.enqueue("c", "harfli", 5, 90.0, 6.0)
+    matchmaker.requeue("harfli", 5, (80.0, 1.0, "a"))
+
+    queue = matchmaker.queues[("harfli", 5)]
+
+    assert not queue.ordered
+
+    pairs = queue.pair(now=7.0, window=15.0, growth=0.0)
+
+    assert [(x[2], y[2]) for x, y in pairs] == [("a", "c")]
+    assert list(queue.waiting) == ["b"] and queue.ordered
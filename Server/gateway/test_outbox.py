@@ -0,0 +1,101 @@
+from gateway.outbox import DISCONNECT, DROP_OLDEST, Outbox, OutboxStats
+
+import asyncio
+
+class FakeSocket:
+    def __init__(self, delay: float = 0.0) -> None:
+        self.delay = delay
+        self.sent: list[str] = []
+        self.closed = False
+
+    async def send_text(self, text: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+
+        self.sent.append(text)
+
+    async def close(self):
+        self.closed = True
+
+def test_frames_are_written_in_order():
+    async def main():
+        socket = FakeSocket()
+        outbox = Outbox(socket, OutboxStats())
+
+        for i in range(5):
+            outbox.push(str(i))
+
+        await outbox.close()
+
+        return socket, outbox
+
+    socket, outbox = asyncio.run(main())
+
+    assert socket.sent == ["0", "1", "2", "3", "4"]
+    assert socket.closed and outbox.stats.sent == 5
+
+def test_frames_with_a_key_replace_each_other():
+    stats = OutboxStats()
+    outbox = Outbox(FakeSocket(), stats)
+    outbox.task = object()
+
+    outbox.push("a", key="status:x")
+    outbox.push("b")
+    outbox.push("c", key="status:x")
+
+    assert len(outbox) == 2 and stats.coalesced == 1
+    assert outbox.drain() == ["b", "c"]
+
+def test_overflow_drops_oldest():
+    stats = OutboxStats()
+    outbox = Outbox(FakeSocket(), stats, size=3, policy=DROP_OLDEST)
+    outbox.task = object()
+
+    for i in range(5):
+        outbox.push(str(i))
+
+    assert outbox.drain() == ["2", "3", "4"]
+    assert stats.dropped == 2 and stats.overflows == 2 and not outbox.closed
+
+def test_overflow_disconnects_and_keeps_frames():
+    async def main():
+        socket = FakeSocket(delay=1.0)
+        stats = OutboxStats()
+        outbox = Outbox(socket, stats, size=2, policy=DISCONNECT)
+
+        # The writer takes "0" and is still sending it when the outbox
+        # overflows.
+        outbox.push("0")
+        await asyncio.sleep(0)
+
+        for i in range(1, 4):
+            outbox.push(str(i))
+
+        await asyncio.sleep(0)
+
+        return socket, stats, outbox, outbox.drain()
+
+    socket, stats, outbox, frames = asyncio.run(main())
+
+    assert outbox.closed and socket.closed and socket.sent == []
+    assert stats.overflows == 1
+    # The frame in flight goes back to the front, and the one that
+    # overflowed is kept too.
+    assert frames == ["0", "1", "2", "3"] and stats.dropped == 0
+
+def test_slow_send_aborts():
+    async def main():
+        socket = FakeSocket(delay=1.0)
+        stats = OutboxStats()
+        outbox = Outbox(socket, stats, send_timeout=0.05)
+
+        outbox.push("a")
+        await asyncio.sleep(0.1)
+
+        return socket, stats, outbox
+
+    socket, stats, outbox = asyncio.run(main())
+
+    assert outbox.closed and socket.closed
+    assert stats.failed == 1 and socket.sent == []
+    assert outbox.drain() == ["a"]
@@ -0,0 +1,29 @@
+from gateway import ratelimit
+from gateway.ratelimit import TokenBucket
+
+def test_bucket_allows_burst_then_refills():
+    bucket = TokenBucket(rate=2.0, burst=3.0, tokens=3.0, updated=0.0)
+
+    assert [bucket.take(0.0) for _ in range(4)] == [True, True, True, False]
+    assert not bucket.take(0.25)
+    assert bucket.take(0.5)
+    assert not bucket.take(0.5)
+
+def test_bucket_never_holds_more_than_burst():
+    bucket = TokenBucket(rate=1.0, burst=2.0, tokens=0.0, updated=0.0)
+
+    assert [bucket.take(100.0) for _ in range(3)] == [True, True, False]
+
+def test_allow_creates_full_buckets_per_key():
+    buckets = {}
+
+    assert all(ratelimit.allow(buckets, 4, (0.5, 3.0), 10.0) for _ in range(3))
+    assert not ratelimit.allow(buckets, 4, (0.5, 3.0), 10.0)
+    assert ratelimit.allow(buckets, ratelimit.ANY, (20.0, 40.0), 10.0)
+    assert set(buckets) == { 4, ratelimit.ANY }
+
+def test_parse_limits():
+    assert ratelimit.parse_limits("game_request=0.5/3, frames=20/40,bad,other=1") == {
+        "game_request": (0.5, 3.0),
+        "frames": (20.0, 40.0)
+    }
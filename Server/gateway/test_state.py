@@ -0,0 +1,107 @@
+from gateway.state import MemoryBackend, RedisBackend, RemoteSocket, worker_topic
+
+import asyncio
+import pytest
+
+def redis_backend(monkeypatch) -> RedisBackend:
+    fakeredis = pytest.importorskip("fakeredis")
+    import redis.asyncio as redis
+
+    monkeypatch.setattr(redis, "from_url", lambda url, **kwargs: fakeredis.aioredis.FakeRedis(**kwargs))
+
+    return RedisBackend("redis://fake", ttl=60)
+
+@pytest.fixture(params=["memory", "redis"])
+def backend(request, monkeypatch):
+    if request.param == "memory":
+        return MemoryBackend()
+
+    return redis_backend(monkeypatch)
+
+def record(name: str, worker: str = "w1") -> dict:
+    return { "worker": worker, "username": name, "status": 1 }
+
+def test_members_come_back_in_join_order(backend):
+    async def main():
+        for wid in ("b", "a", "c"):
+            await backend.set_user(wid, record(wid))
+            await backend.add_member("harfli", 5, wid)
+
+        await backend.remove_member("harfli", 5, "a")
+        members = await backend.get_members("harfli", 5)
+        await backend.close()
+
+        return members
+
+    assert asyncio.run(main()) == [{ "uid": "b", **record("b") }, { "uid": "c", **record("c") }]
+
+def test_members_without_a_user_are_left_out(backend):
+    async def main():
+        await backend.set_user("a", record("a"))
+        await backend.set_user("b", record("b"))
+        await backend.add_member("harfli", 5, "a")
+        await backend.add_member("harfli", 5, "b")
+        await backend.delete_user("a")
+        members = await backend.get_members("harfli", 5)
+        await backend.close()
+
+        return members
+
+    assert asyncio.run(main()) == [{ "uid": "b", **record("b") }]
+
+def test_games_are_owned_by_a_worker(backend):
+    async def main():
+        await backend.set_game("g", "w1")
+        owner = await backend.get_game("g")
+        await backend.delete_game("g")
+        deleted = await backend.get_game("g")
+        await backend.close()
+
+        return owner, deleted
+
+    assert asyncio.run(main()) == ("w1", None)
+
+def test_remote_socket_is_routed_to_its_worker(backend):
+    async def main():
+        received = asyncio.Queue()
+
+        async def handler(topic: str, message: dict):
+            await received.put((topic, message))
+
+        await backend.subscribe([worker_topic("w2")], handler)
+        await asyncio.sleep(0.05)
+
+        socket = RemoteSocket(backend, "w2", "a")
+        await socket.send_text("hello")
+        await socket.close()
+
+        messages = [await asyncio.wait_for(received.get(), 1) for _ in range(2)]
+        await backend.close()
+
+        return messages
+
+    assert asyncio.run(main()) == [
+        ("worker:w2", { "kind": "deliver", "wids": ["a"], "text": "hello" }),
+        ("worker:w2", { "kind": "close", "wid": "a" })
+    ]
+
+def test_redis_records_expire_unless_refreshed(monkeypatch):
+    backend = redis_backend(monkeypatch)
+
+    async def main():
+        await backend.set_user("a", record("a"))
+        await backend.set_game("g", "w1")
+        await backend.redis.expire(backend.key("user", "a"), 5)
+        await backend.redis.expire(backend.key("game", "g"), 5)
+        await backend.refresh(["a"], ["g"])
+        ttls = (await backend.redis.ttl(backend.key("user", "a")), await backend.redis.ttl(backend.key("game", "g")))
+
+        # A member whose user key expired is dropped from the room set.
+        await backend.add_member("harfli", 5, "b")
+        await backend.get_members("harfli", 5)
+        room = await backend.redis.zrange(backend.key("room", "harfli", 5), 0, -1)
+        await backend.close()
+
+        return ttls, room
+
+    assert asyncio.run(main()) == ((60, 60), [])
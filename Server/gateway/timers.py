@@ -0,0 +1,48 @@
+from typing import Awaitable, Callable
+
+from logs import logs
+
+import asyncio
+
+logger = logs.get_logger("timers")
+
+class TimerService:
+    def __init__(self) -> None:
+        self.handles: dict[str, asyncio.TimerHandle] = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.handles
+
+    def __len__(self) -> int:
+        return len(self.handles)
+
+    # Scheduling an existing key replaces its deadline, which is how timers
+    # are reset.
+    def schedule(self, key: str, delay: float, callback: Callable[[], Awaitable[None]]):
+        self.cancel(key)
+
+        loop = asyncio.get_running_loop()
+        self.handles[key] = loop.call_later(delay, self.fire, key, callback)
+
+    def cancel(self, key: str):
+        handle = self.handles.pop(key, None)
+
+        if handle is not None:
+            handle.cancel()
+
+    def cancel_all(self):
+        for handle in self.handles.values():
+            handle.cancel()
+
+        self.handles.clear()
+
+    def fire(self, key: str, callback: Callable[[], Awaitable[None]]):
+        self.handles.pop(key, None)
+
+        asyncio.ensure_future(self.run(callback))
+
+    async def run(self, callback: Callable[[], Awaitable[None]]):
+        try:
+            await callback()
+        except Exception:
+            logger.exception("timer_failed")
@@ -0,0 +1,132 @@
+from dotenv import load_dotenv
+from logging.handlers import QueueHandler, QueueListener
+from datetime import datetime, timezone
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+
+load_dotenv()
+
+level = getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO)
+queue_size = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# "event=rate" pairs, e.g. "check_word=0.01,join_room=0.5". Events without a
+# rate are always logged.
+def parse_rates(value: str) -> dict[str, float]:
+    rates = {}
+
+    for pair in value.split(","):
+        if "=" not in pair:
+            continue
+
+        event, rate = pair.split("=", 1)
+        rates[event.strip()] = float(rate)
+
+    return rates
+
+sample_rates: dict[str, float] = {
+    "check_word": 0.01,
+    **parse_rates(os.getenv("LOG_SAMPLE_RATES", ""))
+}
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage()
+        }
+
+        entry.update(getattr(record, "fields", {}))
+
+        if record.exc_info:
+            entry["error"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+# Records are handed to the listener thread as they are, so formatting and
+# writing never happen on the event loop. When the queue is full, records
+# are dropped and counted instead of blocking.
+class AsyncHandler(QueueHandler):
+    def __init__(self, records: queue.Queue) -> None:
+        super().__init__(records)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+handler: AsyncHandler | None = None
+listener: QueueListener | None = None
+
+def setup():
+    global handler, listener
+
+    if handler is not None:
+        return
+
+    records = queue.Queue(maxsize=queue_size)
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter())
+
+    handler = AsyncHandler(records)
+    listener = QueueListener(records, output, respect_handler_level=True)
+    listener.start()
+
+    logger = logging.getLogger("wordle")
+    logger.setLevel(level)
+    logger.addHandler(handler)
+    logger.propagate = False
+
+    atexit.register(listener.stop)
+
+class EventLogger:
+    def __init__(self, name: str) -> None:
+        self.logger = logging.getLogger(name)
+
+    # Events are short snake_case names; everything else goes in fields.
+    def log(self, level: int, event: str, exc_info: bool = False, **fields):
+        if not self.logger.isEnabledFor(level):
+            return
+
+        rate = sample_rates.get(event)
+
+        if rate is not None and rate < 1.0:
+            if random.random() >= rate:
+                return
+
+            fields["sample_rate"] = rate
+
+        self.logger.log(level, event, exc_info=exc_info, extra={ "fields": fields })
+
+    def debug(self, event: str, **fields):
+        self.log(logging.DEBUG, event, **fields)
+
+    def info(self, event: str, **fields):
+        self.log(logging.INFO, event, **fields)
+
+    def warning(self, event: str, **fields):
+        self.log(logging.WARNING, event, **fields)
+
+    def error(self, event: str, **fields):
+        self.log(logging.ERROR, event, **fields)
+
+    # Logs the exception being handled along with the event.
+    def exception(self, event: str, **fields):
+        self.log(logging.ERROR, event, exc_info=True, **fields)
+
+def get_logger(name: str) -> EventLogger:
+    setup()
+
+    return EventLogger(f"wordle.{name}")
@@ -0,0 +1,162 @@
+from dotenv import load_dotenv
+from typing import Callable
+
+from logs import logs
+
+import bisect
+import os
+import threading
+
+load_dotenv()
+
+logger = logs.get_logger("metrics")
+
+# With metrics disabled every update returns straight away and /metrics is
+# not served.
+enabled = os.getenv("METRICS_ENABLED", "true").lower() not in ("0", "false", "no", "off")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+Labels = tuple[str, ...]
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def format_labels(names: tuple[str, ...], values: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{escape(str(value))}"' for name, value in zip(names, values)]
+
+    if extra:
+        pairs.append(extra)
+
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Metric:
+    kind = "untyped"
+
+    # A callback is read at scrape time, for values the process already
+    # keeps elsewhere. It returns one value, or a dict keyed by label values.
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), callback: Callable[[], float | dict[Labels, float]] | None = None) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.callback = callback
+        self.values: dict[Labels, float] = {}
+        self.lock = threading.Lock()
+
+    def collect(self) -> dict[Labels, float]:
+        if self.callback is None:
+            with self.lock:
+                return dict(self.values)
+
+        values = self.callback()
+
+        return values if isinstance(values, dict) else { (): values }
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+        for labels, value in self.collect().items():
+            lines.append(f"{self.name}{format_labels(self.labels, labels)} {format_value(value)}")
+
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        if not enabled:
+            return
+
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0.0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labels: str):
+        if not enabled:
+            return
+
+        with self.lock:
+            self.values[labels] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: a count per bucket plus one for +Inf, the sum and
+        # the total count.
+        self.series: dict[Labels, list] = {}
+
+    def observe(self, value: float, *labels: str):
+        if not enabled:
+            return
+
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self.lock:
+            series = self.series.get(labels)
+
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+        with self.lock:
+            series = { labels: (list(counts), total, count) for labels, (counts, total, count) in self.series.items() }
+
+        for labels, (counts, total, count) in series.items():
+            cumulative = 0
+
+            for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket
+                le = 'le="' + format_value(bound) + '"'
+
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, labels, le)} {cumulative}")
+
+            lines.append(f"{self.name}_sum{format_labels(self.labels, labels)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, labels)} {count}")
+
+        return lines
+
+registry: list[Metric] = []
+
+def register(metric: Metric) -> Metric:
+    registry.append(metric)
+
+    return metric
+
+def counter(name: str, help: str, labels: tuple[str, ...] = (), callback: Callable | None = None) -> Counter:
+    return register(Counter(name, help, labels, callback))
+
+def gauge(name: str, help: str, labels: tuple[str, ...] = (), callback: Callable | None = None) -> Gauge:
+    return register(Gauge(name, help, labels, callback))
+
+def histogram(name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+    return register(Histogram(name, help, labels, buckets))
+
+def render() -> str:
+    lines = []
+
+    for metric in registry:
+        try:
+            lines.extend(metric.render())
+        except Exception:
+            logger.exception("collect_failed", metric=metric.name)
+
+    return "\n".join(lines) + "\n"
@@ -1,23 +1,74 @@
-from fastapi import FastAPI, Depends, HTTPException, WebSocket
+from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
 from pydantic import BaseModel
 from datetime import datetime
 from enum import Enum
 
 from database import database
+from database.results import ResultsPipeline
+from dictionary.dictionary import MappedWordDictionary, WordDictionary, load_dictionary
+from engine import feedback
+from engine.game import Game, GameStatus, Player
+from logs import logs
+from metrics import metrics
+from gateway.broadcast import Broadcaster
+from gateway.dispatch import FAILED, RATE_LIMITED, CheckWord, ConfirmWord, Dispatcher, FrameError, GameReference, GameRequest, JoinRoom, SyncRoom
+from gateway.heartbeat import HeartbeatScheduler
+from gateway.matchmaking import Entry, Matchmaker
+from gateway.sweeper import ExpirySweeper
+from gateway.timers import TimerService
+from gateway.outbox import DISCONNECT, Outbox, OutboxStats
+from gateway import ratelimit
+from gateway.ratelimit import TokenBucket
+from gateway.replay import ReplayBuffer
+from gateway.rooms import Room, coalesce_key
+from gateway.state import REVOKED, RemoteSocket, create_backend, room_topic, worker_topic
+from gateway import encoding
+from gateway.encoding import Event
 from typing import Annotated
 from dataclasses import dataclass, field
+from contextlib import asynccontextmanager
 
 import uuid
 import asyncio
+import hmac
 import random
-
+import secrets
 import time
-import json
 
-app = FastAPI()
+logger = logs.get_logger("gateway")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if not database.secret_key:
+        logger.error("jwt_secret_missing")
+        raise RuntimeError("JWT_SECRET is not set")
+
+    await database.ensure_indexes_async()
+
+    problems = await database.run_in_executor(database.verify_indexes)
+
+    if problems:
+        logger.warning("indexes_outdated", problems=problems)
+
+    missing = sorted(database.unique_indexes.intersection(problems))
+
+    if missing:
+        logger.error("unique_indexes_missing", indexes=missing)
+        raise RuntimeError(f"Missing unique indexes: {', '.join(missing)}")
+
+    # Started here rather than on the first connection, so revoked tokens
+    # reach this worker even before anyone connects to it.
+    await manager.start()
+
+    yield
+
+    await manager.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "*"
@@ -47,28 +98,50 @@ def login_required(credentials: Annotated[HTTPAuthorizationCredentials , Depends
     if result is None:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
-    print(result)
-
     return User(**result)
 
 @app.post("/api/login")
 async def login(login_request: LoginRequest):
-    result = database.login(login_request.username, login_request.password)
+    result = await database.login_async(login_request.username, login_request.password)
 
     return result.to_dict()
 
 @app.post("/api/register")
 async def register(login_request: LoginRequest):
-    result = database.register(login_request.username, login_request.password)
+    result = await database.register_async(login_request.username, login_request.password)
 
     return result.to_dict()
 
+@app.post("/api/logout")
+async def logout(credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)], user: Annotated[User, Depends(login_required)]):
+    database.revoke_token(credentials.credentials)
+    await manager.revoke_token(credentials.credentials)
+
+    return { "error": False }
+
 @app.get("/api/@me")
 async def get_user_details(credentials: Annotated[User, Depends(login_required)]):
-    result = database.get_user(credentials.uid)
+    result = await database.get_user_async(credentials.uid)
 
     return result.to_dict()
 
+@app.get("/api/leaderboard/{channel}/{room}")
+async def get_leaderboard(channel: str, room: int):
+    if channel not in ["harfli", "harfsiz"] or room not in [4, 5, 6, 7]:
+        raise HTTPException(status_code=404, detail="Room not found")
+
+    return {
+        "error": False,
+        "leaderboard": await manager.results.get_leaderboard(channel, room)
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    if not metrics.enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 # websockets
 
 class Status(Enum):
@@ -81,68 +154,501 @@ class UserDetails(BaseModel):
     uid: str
     username: str
     status: Status
+    account_id: str | None = None
 
-@dataclass
+@dataclass(slots=True)
 class Connection:
-    socket: WebSocket
+    socket: Outbox | RemoteSocket | ReplayBuffer
     user: UserDetails | None = None
     token: str | None = None
     channel: str | None = None
     room: int | None = None
     game_id: str | None = None
+    game_host: str | None = None
+    worker: str | None = None
+    resume_token: str | None = None
+    # Rate limit buckets by opcode, plus ratelimit.ANY for all frames.
+    buckets: dict[int, TokenBucket] = field(default_factory=dict)
 
-@dataclass
-class Player:
-    websocket_id: str
-    word: str | None = None
-    letter_informations: dict | None = None
-    letters_known_correctly: list[str] = field(default_factory=list)
-    letters_known_incorrectly: list[str] = field(default_factory=list)
-    score: int = 0
-    predictions_count: int = 0
-    confirm_time: float = 0.0
-
-@dataclass
-class Game:
-    players: list[Player]
-    channel: str
-    room: int
-    timestamp: float
-    status: str = "created"
+handler_seconds = metrics.histogram("wordle_gateway_handler_seconds", "Time spent handling a gateway frame", ("op",))
+send_failures = metrics.counter("wordle_gateway_send_failures_total", "Broadcast sends that failed or timed out")
+throttled_frames = metrics.counter("wordle_gateway_throttled_frames_total", "Frames refused by a rate limit", ("op",))
+rejected_frames = metrics.counter("wordle_gateway_rejected_frames_total", "Frames answered with INVALID_FRAME", ("reason",))
 
 class ConnectionManager:
     def __init__(self) -> None:
         self.active_connections: dict[str, Connection] = {}
         self.games: dict[str, Game] = {}
-        self.channels: dict[str, dict[int, list[str]]] = {
+        self.channels: dict[str, dict[int, Room]] = {
             "harfli": {
-                4: [],
-                5: [],
-                6: [],
-                7: []
+                4: Room(),
+                5: Room(),
+                6: Room(),
+                7: Room()
             },
             "harfsiz": {
-                4: [],
-                5: [],
-                6: [],
-                7: []
+                4: Room(),
+                5: Room(),
+                6: Room(),
+                7: Room()
             }
         }
-        self.scores: dict[str, int] = {}
         self.heartbeat_interval = 15.0
         self.valid_words = self.get_valid_words()
+        self.broadcaster = Broadcaster(send_timeout=5.0)
+        self.outbox_size = 256
+        self.outbox_policy = DISCONNECT
+        self.outbox_stats = OutboxStats()
+        self.heartbeats = HeartbeatScheduler(self.heartbeat_interval, self.expire_sessions)
+        self.timers = TimerService()
+        self.auto_guess_delay = 10.0
+        self.worker_id = uuid.uuid4().hex
+        self.state = create_backend()
+        self.remote_refs: dict[str, int] = {}
+        self.state_refresh = 20.0
+        self.refresher: asyncio.Task | None = None
+        self.results = ResultsPipeline()
+        self.matchmaker = Matchmaker(self.create_matches)
+        self.request_timeout = 30.0
+        self.confirm_timeout = 60.0
+        self.confirm_grace = 15.0
+        self.sweeper = ExpirySweeper(self.get_game_deadline, self.expire_games)
+        self.expired_games: dict[str, int] = { "requests": 0, "unconfirmed": 0, "forfeited": 0 }
+        self.resume_grace = 30.0
+        self.replay_size = 64
+        self.frame_limit = ratelimit.overrides.get("frames", (20.0, 40.0))
+        self.heartbeat_limit = ratelimit.overrides.get("heartbeat", (1.0, 5.0))
+        self.dispatcher = Dispatcher()
+        self.add_routes()
+        self.started = False
+
+    def add_routes(self):
+        route = self.dispatcher.route
+
+        route(3, "join_room", self.join_room, JoinRoom, limit=(1.0, 5.0))
+        route(4, "game_request", self.send_game_request, GameRequest, fields=("uid",), limit=(0.5, 3.0))
+        route(5, "accept_request", self.accept_request, GameReference, forwarded=True, limit=(2.0, 5.0))
+        route(6, "decline_request", self.decline_request, GameReference, forwarded=True, limit=(2.0, 5.0))
+        route(7, "confirm_word", self.confirm_word, ConfirmWord, forwarded=True, limit=(1.0, 3.0))
+        route(10, "check_word", self.check_word, CheckWord, forwarded=True, limit=(2.0, 5.0))
+        route(11, "check_word_exists", lambda wid, data: self.check_word_exists(wid), forwarded=True, limit=(2.0, 5.0))
+        route(12, "time_is_up", lambda wid, data: self.time_is_up(wid), forwarded=True, limit=(1.0, 3.0))
+        route(13, "sync_room", self.sync_room, SyncRoom, logged=False, limit=(2.0, 5.0))
+        route(14, "join_queue", self.join_queue, limit=(1.0, 5.0))
+        route(15, "leave_queue", lambda wid, data: self.leave_queue(wid), limit=(1.0, 5.0))
+
+    async def start(self):
+        if self.started:
+            return
+
+        self.started = True
+        self.heartbeats.start()
+        self.results.start()
+        self.matchmaker.start()
+        self.sweeper.start()
+        self.refresher = asyncio.ensure_future(self.refresh_state())
+
+        topics = [worker_topic(self.worker_id), REVOKED]
+
+        for channel, rooms in self.channels.items():
+            for number, room in rooms.items():
+                topics.append(room_topic(channel, number))
+
+                for member in await self.state.get_members(channel, number):
+                    room.add_user(member)
+
+        await self.state.subscribe(topics, self.on_state_message)
+
+    async def stop(self):
+        self.started = False
+        self.heartbeats.stop()
+        self.matchmaker.stop()
+        self.sweeper.stop()
+        self.timers.cancel_all()
+
+        if self.refresher is not None:
+            self.refresher.cancel()
+            self.refresher = None
+
+        await self.results.stop()
+        await self.state.close()
+
+    # Keeps the shared records of this worker's users and games alive.
+    async def refresh_state(self):
+        while True:
+            await asyncio.sleep(self.state_refresh)
+
+            wids = [wid for wid, c in self.active_connections.items() if c.worker is None and c.user is not None]
+
+            try:
+                await self.state.refresh(wids, list(self.games))
+            except Exception:
+                logger.exception("state_refresh_failed", users=len(wids), games=len(self.games))
+
+    async def on_state_message(self, topic: str, message: dict):
+        if topic.startswith("room:"):
+            _, channel, room = topic.split(":")
+
+            if message["origin"] != self.worker_id:
+                room = self.channels[channel][int(room)]
+                event = room.apply(message["event"])
+
+                await self.broadcast(room.members, encoding.encode(event), key=coalesce_key(event))
+
+            return
+
+        kind = message["kind"]
+
+        if kind == "deliver":
+            await self.broadcast(message["wids"], message["text"], buffered=True)
+        elif kind == "close":
+            await self.evict(message["wid"], resumable=False)
+        elif kind == "sync":
+            connection = self.active_connections.get(message["wid"])
+
+            if connection is not None and connection.worker is None:
+                await self.set_status(connection, Status(message["status"]), message["game_id"], message["host"])
+        elif kind == "frame":
+            if message["wid"] in self.active_connections:
+                await self.message(message["wid"], message["payload"])
+        elif kind == "quit":
+            if message["wid"] in self.active_connections:
+                await self.quit_game(message["wid"])
+        elif kind == "revoke":
+            database.revoke_token(message["token"])
+
+            for wid in [w for w, c in self.active_connections.items() if c.worker is None and c.token == message["token"]]:
+                await self.evict(wid, resumable=False)
+
+    # Revokes the token on every worker, which also ends the sessions that
+    # were opened with it.
+    async def revoke_token(self, token: str):
+        await self.state.publish(REVOKED, { "kind": "revoke", "token": token })
+
+    def get_valid_words(self) -> WordDictionary | MappedWordDictionary:
+        return load_dictionary("words.json", "words.bin")
+
+    async def send(self, socket: Outbox | RemoteSocket | ReplayBuffer, payload: Event | dict | str):
+        await socket.send_text(encoding.encode(payload))
+
+    # Sessions waiting to resume only keep frames sent to them directly;
+    # room events are skipped and the roster is sent again on resume.
+    async def broadcast(self, wids: list[str], payload: Event | dict | str, buffered: bool = False, key: str | None = None):
+        sockets = {
+            w: self.active_connections[w].socket
+            for w in wids
+            if w in self.active_connections
+            and self.active_connections[w].worker is None
+            and (buffered or not isinstance(self.active_connections[w].socket, ReplayBuffer))
+        }
+
+        failed = await self.broadcaster.broadcast(sockets, payload, key)
+
+        if failed:
+            send_failures.inc(amount=len(failed))
+
+        for w in failed:
+            asyncio.ensure_future(self.evict(w))
+
+    # Room events go to the local members and, through the backend, to the
+    # members connected to other workers.
+    async def broadcast_room(self, channel: str, room: int, payload: dict):
+        event = self.channels[channel][room].apply(payload)
+
+        await self.send_room_event(channel, room, payload, event)
+
+    # Sends an event already applied to the local roster. The skipped member
+    # is one that got the event as part of its own roster.
+    async def send_room_event(self, channel: str, room: int, payload: dict, event: dict, skip: str | None = None):
+        members = self.channels[channel][room].members
+
+        if skip is not None:
+            members = [w for w in members if w != skip]
+
+        await self.broadcast(members, encoding.encode(event), key=coalesce_key(event))
+        await self.state.publish(room_topic(channel, room), { "origin": self.worker_id, "event": payload })
+
+    async def get_connection(self, wid: str) -> Connection | None:
+        connection = self.active_connections.get(wid)
+
+        if connection is not None:
+            return connection
+
+        record = await self.state.get_user(wid)
+
+        if record is None:
+            return None
+
+        connection = Connection(
+            socket=RemoteSocket(self.state, record["worker"], wid),
+            user=UserDetails(uid=wid, username=record["username"], status=Status(record["status"]), account_id=record.get("account_id")),
+            worker=record["worker"]
+        )
+
+        self.active_connections[wid] = connection
+
+        return connection
+
+    # The status of a remote connection is cached from when it was first
+    # looked up, so it is read again from the backend before it is trusted.
+    # A player that left or moved to another worker is no longer online here.
+    async def refresh_connection(self, connection: Connection):
+        record = await self.state.get_user(connection.user.uid)
+
+        if record is None or record["worker"] != connection.worker:
+            connection.user.status = Status.WAITING_RECONNECT
+            return
+
+        connection.user.status = Status(record["status"])
+
+    async def set_status(self, connection: Connection, status: Status, game_id: str | None, host: str | None = None):
+        wid = connection.user.uid
+
+        if status == Status.ONLINE and isinstance(connection.socket, ReplayBuffer):
+            status = Status.WAITING_RECONNECT
+
+        connection.user.status = status
+        connection.game_id = game_id
+        connection.game_host = (host or self.worker_id) if game_id is not None else None
+
+        if status != Status.ONLINE:
+            self.matchmaker.dequeue(wid)
+
+        if connection.worker is not None:
+            await self.state.publish(worker_topic(connection.worker), {
+                "kind": "sync",
+                "wid": wid,
+                "status": status.value,
+                "game_id": game_id,
+                "host": self.worker_id
+            })
+
+            return
+
+        await self.state.set_user(wid, {
+            "worker": self.worker_id,
+            "username": connection.user.username,
+            "status": status.value,
+            "account_id": connection.user.account_id
+        })
+
+    async def remove_game(self, game_id: str):
+        game = self.games.pop(game_id, None)
+
+        self.timers.cancel(game_id)
+        await self.state.delete_game(game_id)
+
+        if game is None:
+            return
+
+        for p in game.players:
+            if p.websocket_id not in self.remote_refs:
+                continue
+
+            self.remote_refs[p.websocket_id] -= 1
+
+            if self.remote_refs[p.websocket_id] == 0:
+                del self.remote_refs[p.websocket_id]
+                self.active_connections.pop(p.websocket_id, None)
+
+    # Frames about a game hosted by another worker are handed to that worker.
+    async def get_game_host(self, connection: Connection, payload: dict) -> str | None:
+        if payload["op"] in (5, 6):
+            game_id = payload["d"]["game_id"]
+
+            if game_id in self.games:
+                return self.worker_id
+
+            return await self.state.get_game(game_id)
+
+        return connection.game_host
+
+    async def evict(self, wid: str, resumable: bool = True):
+        connection = self.active_connections.get(wid)
+
+        if connection is None:
+            return
+
+        socket = connection.socket
+
+        try:
+            await asyncio.wait_for(socket.close(), timeout=self.broadcaster.send_timeout)
+        except Exception:
+            pass
+
+        if resumable:
+            await self.suspend(wid, socket)
+        else:
+            await self.disconnect(wid)
+
+    # A dropped session is kept for a grace period so the client can resume
+    # it, game included, instead of forfeiting and starting over.
+    async def suspend(self, wid: str, socket: WebSocket | Outbox | RemoteSocket | ReplayBuffer):
+        connection = self.active_connections.get(wid)
+
+        if connection is None or isinstance(connection.socket, ReplayBuffer):
+            return
+
+        if socket is not connection.socket and socket is not getattr(connection.socket, "socket", None):
+            return
+
+        if connection.user is None or connection.worker is not None:
+            await self.disconnect(wid)
+            return
+
+        self.heartbeats.untrack(wid)
+
+        outbox = connection.socket
+        connection.socket = ReplayBuffer(self.replay_size)
 
-    def get_valid_words(self):
-        with open("words.json", "r", encoding="utf-8") as file:
-            words = json.load(file)
+        # Frames that were still queued never reached the client either,
+        # and are all kept even when there are more than replay_size.
+        if isinstance(outbox, Outbox):
+            frames = outbox.drain()
+            connection.socket = ReplayBuffer(max(self.replay_size, len(frames)))
 
-            return words
+            for frame in frames:
+                await connection.socket.send_text(frame)
 
-    async def check_token(self, wid: str):
+            outbox.abort()
+
+        self.timers.schedule(f"resume:{wid}", self.resume_grace, lambda: self.disconnect(wid))
+
+        await self.set_status(connection, Status.WAITING_RECONNECT, connection.game_id, connection.game_host)
+        await self.broadcast_status(connection)
+
+    async def broadcast_status(self, connection: Connection):
+        if connection.channel is None or connection.room is None:
+            return
+
+        await self.broadcast_room(connection.channel, connection.room, {
+            "op": 0,
+            "d": {
+                "users": [{
+                    "uid": connection.user.uid,
+                    "status": connection.user.status.value
+                }]
+            },
+            "t": "STATUS_UPDATE"
+        })
+
+    def get_resumable(self, data: dict, account_id: str) -> Connection | None:
+        resume = data.get("resume")
+
+        if not isinstance(resume, dict):
+            return None
+
+        wid = resume.get("wid")
+        token = resume.get("token")
+
+        if not isinstance(wid, str) or not isinstance(token, str):
+            return None
+
+        connection = self.active_connections.get(wid)
+
+        if connection is None or connection.worker is not None or connection.resume_token is None:
+            return None
+
+        # Compared as bytes, since compare_digest refuses non-ASCII strings.
+        if not hmac.compare_digest(connection.resume_token.encode(), token.encode()):
+            return None
+
+        if connection.user is None or connection.user.account_id != account_id:
+            return None
+
+        return connection
+
+    # Moves the new socket onto the old session, which keeps its wid, room
+    # and game, then replays what was sent while it was away.
+    async def resume(self, wid: str, old_wid: str, connection: Connection, token: str) -> str:
+        socket = self.active_connections.pop(wid).socket
+        self.heartbeats.untrack(wid)
+        self.timers.cancel(f"resume:{old_wid}")
+
+        buffer = connection.socket
+
+        if not isinstance(buffer, ReplayBuffer):
+            try:
+                await asyncio.wait_for(buffer.close(), timeout=self.broadcaster.send_timeout)
+            except Exception:
+                pass
+
+            buffer = ReplayBuffer(0)
+
+        connection.socket = socket
+        connection.token = token
+        connection.resume_token = secrets.token_urlsafe(24)
+        self.heartbeats.track(old_wid)
+
+        status = Status.PLAYING if connection.game_id is not None else Status.ONLINE
+
+        await self.set_status(connection, status, connection.game_id, connection.game_host)
+
+        await self.send(socket, {
+            "op": 0,
+            "d": {
+                "wid": old_wid,
+                "resume_token": connection.resume_token,
+                "replayed": len(buffer),
+                "dropped": buffer.dropped
+            },
+            "t": "RESUMED"
+        })
+
+        for frame in buffer.drain():
+            await self.send(socket, frame)
+
+        if connection.channel is not None and connection.room is not None:
+            await self.send(socket, self.channels[connection.channel][connection.room].join_frame())
+
+        await self.broadcast_status(connection)
+
+        return old_wid
+
+    async def expire_sessions(self, wids: list[str]):
+        await asyncio.gather(*(self.evict(w) for w in wids))
+
+    # Heartbeats skip the dispatcher, so they are limited here. One over the
+    # limit is dropped without an ack and does not count as a beat.
+    async def heartbeat(self, wid: str):
+        connection = self.active_connections.get(wid)
+
+        if connection is None:
+            return
+
+        now = time.monotonic()
+
+        if not ratelimit.allow(connection.buckets, ratelimit.ANY, self.frame_limit, now):
+            throttled_frames.inc("all")
+            return
+
+        if not ratelimit.allow(connection.buckets, 1, self.heartbeat_limit, now):
+            throttled_frames.inc("1")
+            return
+
+        self.heartbeats.beat(wid)
+
+        await self.send(connection.socket, Event(op=11))
+
+    def outbox_metrics(self) -> dict:
+        depths = [len(c.socket) for c in self.active_connections.values() if isinstance(c.socket, Outbox)]
+
+        return {
+            "connections": len(depths),
+            "depth": sum(depths),
+            "max_depth": max(depths, default=0),
+            "sent": self.outbox_stats.sent,
+            "dropped": self.outbox_stats.dropped,
+            "coalesced": self.outbox_stats.coalesced,
+            "overflows": self.outbox_stats.overflows,
+            "failed": self.outbox_stats.failed
+        }
+
+    async def check_token(self, wid: str) -> str:
         connection = self.active_connections[wid]
 
         try:
-            payload = await asyncio.wait_for(connection.socket.receive_json(), timeout=10.0)
+            payload = encoding.loads(await asyncio.wait_for(connection.socket.receive_text(), timeout=10.0))
         except asyncio.TimeoutError:
             await self.invalid_session(wid)
             return
@@ -169,109 +675,117 @@ class ConnectionManager:
                 await self.invalid_session(wid)
                 return
             
+            old_connection = self.get_resumable(data, user["uid"])
+
+            if old_connection is not None:
+                return await self.resume(wid, old_connection.user.uid, old_connection, token)
+
             connection.token = token
-            connection.user = UserDetails(uid=wid, username=user["username"], status=Status.ONLINE)
+            connection.user = UserDetails(uid=wid, username=user["username"], status=Status.ONLINE, account_id=user["uid"])
+
+            await self.set_status(connection, Status.ONLINE, None)
+
+            return wid
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
         
         wid = uuid.uuid4().hex
-        connection = Connection(socket=websocket)
+        connection = Connection(socket=Outbox(
+            websocket,
+            self.outbox_stats,
+            size=self.outbox_size,
+            policy=self.outbox_policy,
+            send_timeout=self.broadcaster.send_timeout
+        ))
+
+        connection.resume_token = secrets.token_urlsafe(24)
 
         self.active_connections[wid] = connection
-        await websocket.send_json({
-            "op": 10,
-            "d": {
-                "wid": wid
-            }
-        })
+        self.heartbeats.track(wid)
 
-        await self.check_token(wid)
+        await self.start()
+        await self.send(connection.socket, Event(op=10, d={ "wid": wid, "resume_token": connection.resume_token }))
 
-        return wid
+        return await self.check_token(wid) or wid
     
     # Have you joined a chamber before?
     async def check_room(self, wid: str, connection: Connection):
         if connection.channel is None or connection.room is None:
             return
         
-        self.channels[connection.channel][connection.room].remove(wid)
+        self.matchmaker.dequeue(wid)
+        self.channels[connection.channel][connection.room].remove_member(wid)
+        await self.state.remove_member(connection.channel, connection.room, wid)
         
-        for w in self.channels[connection.channel][connection.room]:
-            con = self.active_connections[w]
-
-            await con.socket.send_json({
-                "op": 0,
-                "d": {
-                    "user": {
-                        "uid": connection.user.uid,
-                        "username": connection.user.username,
-                        "status": connection.user.status.value
-                    }
-                },
-                "t": "USER_LEAVE_ROOM"
-            })
+        await self.broadcast_room(connection.channel, connection.room, {
+            "op": 0,
+            "d": {
+                "user": {
+                    "uid": connection.user.uid,
+                    "username": connection.user.username,
+                    "status": connection.user.status.value
+                }
+            },
+            "t": "USER_LEAVE_ROOM"
+        })
 
-    async def finish_game(self, connection: Connection, other_connection: Connection):
+    async def finish_game(self, connection: Connection, other_connection: Connection, winner: Connection | None = None):
         game_id = connection.game_id
-        game = self.games[game_id]
+        game = self.games.get(game_id)
 
-        connection.game_id = None
-        connection.user.status = Status.ONLINE
+        if game is None or not game.move(GameStatus.FINISHED):
+            return
 
-        other_connection.game_id = None
-        other_connection.user.status = Status.ONLINE
+        self.record_result(game_id, game, [connection, other_connection], winner)
 
-        for c in self.channels[connection.channel][connection.room]:
-            socket = self.active_connections[c].socket
+        await self.set_status(connection, Status.ONLINE, None)
+        await self.set_status(other_connection, Status.ONLINE, None)
 
-            await socket.send_json({
-                "op": 0,
-                "d": {
-                    "users": [{
-                        "uid": p.websocket_id,
-                        "status": Status.ONLINE.value
-                    } for p in game.players]
-                },
-                "t": "STATUS_UPDATE"
-            })
+        await self.broadcast_room(game.channel, game.room, {
+            "op": 0,
+            "d": {
+                "users": [{
+                    "uid": c.user.uid,
+                    "status": c.user.status.value
+                } for c in (connection, other_connection)]
+            },
+            "t": "STATUS_UPDATE"
+        })
 
-        del self.games[game_id]
+        await self.remove_game(game_id)
     
+    def record_result(self, game_id: str, game: Game, connections: list[Connection], winner: Connection | None):
+        users = { c.user.uid: c.user for c in connections }
+
+        self.results.record({
+            "game_id": game_id,
+            "channel": game.channel,
+            "room": game.room,
+            "finished_at": datetime.now(),
+            "players": [{
+                "uid": users[p.websocket_id].account_id,
+                "username": users[p.websocket_id].username,
+                "word": p.word,
+                "score": p.score,
+                "predictions": p.predictions_count
+            } for p in game.players],
+            "winner": winner.user.account_id if winner is not None else None
+        })
+
     def get_letters_status(self, player_word: str, player: Player, other_player: Player):
         letters = []
 
-        for index, letter in enumerate(player_word):
-            if letter == other_player.word[index]:
-                letters.append({
-                    "value": letter,
-                    "status": "correct"
-                })
-                
-                player.letters_known_correctly.append(letter)
-
-            elif letter in other_player.word:
-                count = other_player.word.count(letter)
-
-                previous_letters = [l["value"] for l in letters]
-
-                if previous_letters.count(letter) < count:
-                    letters.append({
-                        "value": letter,
-                        "status": "present"
-                    })
+        for letter, status in zip(player_word, feedback.score(player_word, other_player.word, other_player.letter_counts)):
+            letters.append({
+                "value": letter,
+                "status": status
+            })
 
-                    player.letters_known_incorrectly.append(letter)
-                else:
-                    letters.append({
-                        "value": letter,
-                        "status": "absent"
-                    })
-            else:
-                letters.append({
-                    "value": letter,
-                    "status": "absent"
-                })
+            if status == "correct":
+                player.letters_known_correctly.append(letter)
+            elif status == "present":
+                player.letters_known_incorrectly.append(letter)
 
         return letters
 
@@ -282,9 +796,6 @@ class ConnectionManager:
         if connection.user.status != Status.ONLINE:
             return
         
-        if "channel" not in data or "room" not in data:
-            return
-        
         channel = data["channel"]
         room = data["room"]
 
@@ -302,42 +813,61 @@ class ConnectionManager:
         connection.channel = channel
         connection.room = room
 
-        users = []
+        payload = {
+            "op": 0,
+            "d": {
+                "user": {
+                    "uid": connection.user.uid,
+                    "username": connection.user.username,
+                    "status": connection.user.status.value
+                }
+            },
+            "t": "USER_JOIN_ROOM"
+        }
 
-        for w in self.channels[channel][room]:
-            con = self.active_connections[w]
-            socket = con.socket
+        # The roster is read, the join applied and the member added without
+        # an await in between, so the version sent with the roster covers
+        # exactly the events in it and every later event reaches this socket.
+        room_state = self.channels[channel][room]
+        snapshot = room_state.snapshot()
+        changes = None
 
-            if con.user is None:
-                continue
+        if "version" in data and "epoch" in data:
+            changes = room_state.changes_since(data["version"], data["epoch"])
 
-            users.append({
-                "uid": con.user.uid,
-                "username": con.user.username,
-                "status": con.user.status.value
-            })
+        event = room_state.apply(payload)
+        room_state.add_member(wid)
 
-            await socket.send_json({
-                "op": 0,
-                "d": {
-                    "user": {
-                        "uid": connection.user.uid,
-                        "username": connection.user.username,
-                        "status": connection.user.status.value
-                    }
-                },
-                "t": "USER_JOIN_ROOM"
-            })
+        if changes is not None:
+            frame = room_state.delta_frame(changes)
+        else:
+            frame = room_state.join_frame(snapshot)
 
-        await connection.socket.send_json({
-            "op": 0,
-            "d": {
-                "users": users
-            },
-            "t": "JOIN_ROOM"
-        })
+        await self.send(connection.socket, frame)
+        await self.send_room_event(channel, room, payload, event, skip=wid)
+        await self.state.add_member(channel, room, wid)
 
-        self.channels[channel][room].append(wid)
+    # Clients that already hold a roster send its version and epoch and get
+    # only the changes since then when those are still known.
+    def get_roster(self, room: Room, data: dict) -> dict | str:
+        if "version" in data and "epoch" in data:
+            changes = room.changes_since(data["version"], data["epoch"])
+
+            if changes is not None:
+                return room.delta_frame(changes)
+
+        return room.join_frame()
+
+    # opcode 13
+    async def sync_room(self, wid: str, data: dict):
+        connection = self.active_connections[wid]
+
+        if connection.channel is None or connection.room is None:
+            return
+
+        room = self.channels[connection.channel][connection.room]
+
+        await self.send(connection.socket, self.get_roster(room, data))
 
     # opcode 4
     async def send_game_request(self, wid: str, data: dict):
@@ -346,11 +876,11 @@ class ConnectionManager:
         if connection.user.status != Status.ONLINE:
             return
         
-        if "uid" not in data:
-            return
-        
         uid = data["uid"]
-        other_connection = self.active_connections[uid]
+        other_connection = await self.get_connection(uid)
+
+        if other_connection is None:
+            return
 
         game_id = uuid.uuid4().hex
 
@@ -363,8 +893,14 @@ class ConnectionManager:
             room=connection.room,
             timestamp=datetime.now().timestamp()
         )
+
+        await self.state.set_game(game_id, self.worker_id)
+        self.sweeper.track(game_id)
+
+        if other_connection.worker is not None:
+            self.remote_refs[uid] = self.remote_refs.get(uid, 0) + 1
         
-        await other_connection.socket.send_json({
+        await self.send(other_connection.socket, {
             "op": 0,
             "d": {
                 "from": {
@@ -381,33 +917,40 @@ class ConnectionManager:
     async def accept_request(self, wid: str, data: dict):
         connection = self.active_connections[wid]
 
+        if connection.worker is not None:
+            await self.refresh_connection(connection)
+
         if connection.user.status != Status.ONLINE:
             return
         
-        if "game_id" not in data:
-            return
-        
         game_id = data["game_id"]
-        game = self.games[game_id]
+        game = self.games.get(game_id)
 
         if game is None:
             return
         
-        if game.status != "created":
+        if game.status != GameStatus.CREATED:
             return
         
-        game.status = "accepted"
+        await self.start_game(game_id, game)
+
+    async def start_game(self, game_id: str, game: Game):
+        if not game.move(GameStatus.ACCEPTED):
+            return
+
+        game.timestamp = datetime.now().timestamp()
 
         for player in game.players:
             player_connection = self.active_connections[player.websocket_id]
-            player_connection.user.status = Status.PLAYING
-            player_connection.game_id = game_id
+            opponent = self.active_connections[player.opponent.websocket_id].user
+
+            await self.set_status(player_connection, Status.PLAYING, game_id)
 
             d = {
                 "game_id": game_id,
                 "opponent": {
-                    "uid": self.active_connections[game.players[1 - game.players.index(player)].websocket_id].user.uid,
-                    "username": self.active_connections[game.players[1 - game.players.index(player)].websocket_id].user.username
+                    "uid": opponent.uid,
+                    "username": opponent.username
                 }
             }
 
@@ -424,25 +967,106 @@ class ConnectionManager:
                 d["letter"] = l
                 d["index"] = i
 
-            await player_connection.socket.send_json({
+            await self.send(player_connection.socket, {
                 "op": 0,
                 "d": d,
                 "t": "GAME_ACCEPTED"
             })
 
-        for w in self.channels[game.channel][game.room]:
-            con = self.active_connections[w]
+        await self.broadcast_room(game.channel, game.room, {
+            "op": 0,
+            "d": {
+                "users": [{
+                    "uid": p.websocket_id,
+                    "status": Status.PLAYING.value
+                } for p in game.players]
+            },
+            "t": "STATUS_UPDATE"
+        })
 
-            await con.socket.send_json({
-                "op": 0,
-                "d": {
-                    "users": [{
-                        "uid": p.websocket_id,
-                        "status": con.user.status.value
-                    } for p in game.players]
-                },
-                "t": "STATUS_UPDATE"
-            })
+    # opcode 14
+    async def join_queue(self, wid: str, data: dict):
+        connection = self.active_connections[wid]
+
+        if connection.user.status != Status.ONLINE:
+            return
+
+        if connection.channel is None or connection.room is None or wid in self.matchmaker:
+            return
+
+        channel = connection.channel
+        room = connection.room
+        rating = await self.results.get_rating(connection.user.account_id, channel, room)
+
+        # The player may have left the room or started a game meanwhile.
+        if wid not in self.active_connections or connection.user.status != Status.ONLINE:
+            return
+
+        if connection.channel != channel or connection.room != room:
+            return
+
+        if not self.matchmaker.enqueue(wid, channel, room, rating):
+            return
+
+        await self.send(connection.socket, {
+            "op": 0,
+            "d": {
+                "channel": channel,
+                "room": room,
+                "size": self.matchmaker.size(channel, room)
+            },
+            "t": "MATCHMAKING_QUEUED"
+        })
+
+    # opcode 15
+    async def leave_queue(self, wid: str):
+        connection = self.active_connections[wid]
+
+        if not self.matchmaker.dequeue(wid):
+            return
+
+        await self.send(connection.socket, {
+            "op": 0,
+            "d": {},
+            "t": "MATCHMAKING_CANCELLED"
+        })
+
+    def is_matchable(self, wid: str, channel: str, room: int) -> bool:
+        connection = self.active_connections.get(wid)
+
+        return (
+            connection is not None
+            and connection.worker is None
+            and connection.user.status == Status.ONLINE
+            and connection.channel == channel
+            and connection.room == room
+        )
+
+    # Pairs found by the matchmaker start straight away, as if the request
+    # had been sent and accepted.
+    async def create_matches(self, channel: str, room: int, pairs: list[tuple[Entry, Entry]]):
+        for entry, opponent in pairs:
+            players = [e for e in (entry, opponent) if self.is_matchable(e[2], channel, room)]
+
+            if len(players) < 2:
+                for e in players:
+                    self.matchmaker.requeue(channel, room, e)
+
+                continue
+
+            game_id = uuid.uuid4().hex
+            game = Game(
+                players=[Player(websocket_id=e[2]) for e in players],
+                channel=channel,
+                room=room,
+                timestamp=datetime.now().timestamp()
+            )
+
+            self.games[game_id] = game
+            await self.state.set_game(game_id, self.worker_id)
+            self.sweeper.track(game_id)
+
+            await self.start_game(game_id, game)
 
     # opcode 6
     async def decline_request(self, wid: str, data: dict):
@@ -451,24 +1075,19 @@ class ConnectionManager:
         if connection.user.status != Status.ONLINE:
             return
         
-        if "game_id" not in data:
-            return
-        
         game_id = data["game_id"]
-        game = self.games[game_id]
+        game = self.games.get(game_id)
 
         if game is None:
             return
         
-        if game.status != "created":
+        if not game.move(GameStatus.DECLINED):
             return
-        
-        del self.games[game_id]
 
         for player in game.players:
             socket = self.active_connections[player.websocket_id].socket
 
-            await socket.send_json({
+            await self.send(socket, {
                 "op": 0,
                 "d": {
                     "game_id": game_id
@@ -476,6 +1095,8 @@ class ConnectionManager:
                 "t": "GAME_REJECTED"
             })
 
+        await self.remove_game(game_id)
+
     # opcode 7
     async def confirm_word(self, wid: str, data: dict):
         connection = self.active_connections[wid]
@@ -483,48 +1104,40 @@ class ConnectionManager:
         if connection.user.status != Status.PLAYING:
             return
         
-        if "game_id" not in data or "word" not in data:
-            return
-        
         game_id = data["game_id"]
         word = data["word"]
-        game = self.games[game_id]
+        game = self.games.get(game_id)
 
         if game is None:
             return
         
-        if game.status != "accepted":
+        if game.status != GameStatus.ACCEPTED:
             return
         
-        if datetime.now().timestamp() - game.timestamp > 60:
+        if datetime.now().timestamp() - game.timestamp > self.confirm_timeout:
             return
         
-        player = None
-
-        for p in game.players:
-            if p.websocket_id == wid:
-                player = p
-                break
+        player = game.get_player(wid)
         
         if player is None:
             return
         
-        if player.letter_informations is not None and word[player.letter_informations["index"]] != player.letter_informations["letter"]:
+        if player.word is not None or not self.valid_words.contains(word, game.room):
             return
         
-        if len(word) != game.room or player.word is not None or self.valid_words[word[0]][str(len(word))] is None:
+        if player.letter_informations is not None and word[player.letter_informations["index"]] != player.letter_informations["letter"]:
             return
         
         player.word = word
-        player.confirm_time = 60.0 - (datetime.now().timestamp() - game.timestamp)
+        player.letter_counts = feedback.letter_counts(word)
+        player.confirm_time = self.confirm_timeout - (datetime.now().timestamp() - game.timestamp)
 
-        print(player.word)
-        print(player.confirm_time)
+        logger.debug("word_confirmed", game_id=game_id, wid=wid, confirm_time=player.confirm_time)
 
-        other_player = game.players[1 - game.players.index(player)]
+        other_player = player.opponent
 
         if other_player.word is None:
-            await connection.socket.send_json({
+            await self.send(connection.socket, {
                 "op": 0,
                 "d": {
                     "game_id": game_id
@@ -534,12 +1147,13 @@ class ConnectionManager:
 
             return
         
-        game.status = "playing"
+        if not game.move(GameStatus.PLAYING):
+            return
         
         for p in game.players:
             con = self.active_connections[p.websocket_id]
 
-            await con.socket.send_json({
+            await self.send(con.socket, {
                 "op": 0,
                 "d": {
                     "game_id": game_id
@@ -547,22 +1161,103 @@ class ConnectionManager:
                 "t": "START_GAME"
             })
 
+    # Requests nobody answered and games where a word was never confirmed
+    # are expired. Clients normally end the confirm phase themselves with
+    # opcode 11, so those get a grace period on top of the timeout.
+    def get_game_deadline(self, game_id: str) -> float | None:
+        game = self.games.get(game_id)
+
+        if game is None:
+            return None
+
+        if game.status == GameStatus.CREATED:
+            return game.timestamp + self.request_timeout
+
+        if game.status == GameStatus.ACCEPTED:
+            return game.timestamp + self.confirm_timeout + self.confirm_grace
+
+        return None
+
+    async def expire_games(self, game_ids: list[str]):
+        counts = { "requests": 0, "unconfirmed": 0, "forfeited": 0 }
+
+        for game_id in game_ids:
+            try:
+                kind = await self.expire_game(game_id)
+            except Exception:
+                logger.exception("game_expiry_failed", game_id=game_id)
+                continue
+
+            if kind is not None:
+                counts[kind] += 1
+                self.expired_games[kind] += 1
+
+        logger.info("games_expired", **counts)
+
+    async def expire_game(self, game_id: str) -> str | None:
+        game = self.games.get(game_id)
+
+        if game is None:
+            return None
+
+        # When only one word was confirmed, the game ends the same way as
+        # when the client reports it.
+        if game.status == GameStatus.ACCEPTED:
+            for player in game.players:
+                if player.word is None and player.opponent.word is not None and player.websocket_id in self.active_connections:
+                    await self.check_word_exists(player.websocket_id)
+
+                    if game_id not in self.games:
+                        return "forfeited"
+
+        accepted = game.status == GameStatus.ACCEPTED
+
+        if not game.move(GameStatus.EXPIRED):
+            return None
+
+        for player in game.players:
+            connection = self.active_connections.get(player.websocket_id)
+
+            if connection is None:
+                continue
+
+            if accepted and connection.game_id == game_id:
+                await self.set_status(connection, Status.ONLINE, None)
+
+            await self.send(connection.socket, {
+                "op": 0,
+                "d": {
+                    "game_id": game_id
+                },
+                "t": "GAME_REJECTED"
+            })
+
+        if accepted:
+            await self.broadcast_room(game.channel, game.room, {
+                "op": 0,
+                "d": {
+                    "users": [{
+                        "uid": p.websocket_id,
+                        "status": Status.ONLINE.value
+                    } for p in game.players]
+                },
+                "t": "STATUS_UPDATE"
+            })
+
+        await self.remove_game(game_id)
+
+        return "unconfirmed" if accepted else "requests"
+
     async def check_word(self, wid: str, data: dict):
         connection = self.active_connections[wid]
-        game = self.games[connection.game_id]
+        game = self.games.get(connection.game_id)
 
-        if "word" not in data:
+        if game is None or game.status != GameStatus.PLAYING:
             return
-        
-        player_word = data["word"]
-        print("player word:", player_word)
 
-        player = None
+        player_word = data["word"]
 
-        for p in game.players:
-            if p.websocket_id == wid:
-                player = p
-                break
+        player = game.get_player(wid)
 
         if player is None:
             return
@@ -570,15 +1265,15 @@ class ConnectionManager:
         if player.predictions_count == game.room:
             return
         
-        other_player = game.players[1 - game.players.index(player)]
+        other_player = player.opponent
 
         if other_player is None or other_player.word is None:
             return
         
         letters = []
 
-        if player_word not in self.valid_words[player_word[0]][str(len(player_word))]:
-            await connection.socket.send_json({
+        if not self.valid_words.contains(player_word, game.room):
+            await self.send(connection.socket, {
                 "op": 0,
                 "d": {
                     "letters": [],
@@ -595,7 +1290,7 @@ class ConnectionManager:
 
         letters = self.get_letters_status(player_word, player, other_player)
 
-        await connection.socket.send_json({
+        await self.send(connection.socket, {
             "op": 0,
             "d": {
                 "letters": letters,
@@ -607,7 +1302,7 @@ class ConnectionManager:
 
         other_connection = self.active_connections[other_player.websocket_id]
 
-        await other_connection.socket.send_json({
+        await self.send(other_connection.socket, {
             "op": 0,
             "d": {
                 "letters": letters,
@@ -620,7 +1315,7 @@ class ConnectionManager:
         player.predictions_count += 1
 
         if player_word == other_player.word:
-            await connection.socket.send_json({
+            await self.send(connection.socket, {
                 "op": 0,
                 "d": {
                     "player_word": player.word,
@@ -632,7 +1327,7 @@ class ConnectionManager:
                 "t": "WON_GAME"
             })
 
-            await other_connection.socket.send_json({
+            await self.send(other_connection.socket, {
                 "op": 0,
                 "d": {
                     "player_word": other_player.word,
@@ -644,7 +1339,10 @@ class ConnectionManager:
                 "t": "LOSE_GAME"
             })
 
-            await self.finish_game(connection, other_connection)
+            player.score = 100
+            other_player.score = 0
+
+            await self.finish_game(connection, other_connection, connection)
             
             return
 
@@ -656,53 +1354,57 @@ class ConnectionManager:
                 for p in game.players:
                     con = self.active_connections[p.websocket_id]
 
-                    print(p.score, ": ", p.letters_known_correctly, p.letters_known_incorrectly, p.confirm_time)
+                    logger.debug("game_scored", game_id=connection.game_id, wid=p.websocket_id, score=p.score)
+
+                    won = p.score > p.opponent.score
 
-                    await con.socket.send_json({
+                    await self.send(con.socket, {
                         "op": 0,
                         "d": {
                             "player_word": p.word,
-                            "other_player_word": game.players[1 - game.players.index(p)].word,
+                            "other_player_word": p.opponent.word,
                             "player_score": p.score,
-                            "other_player_score": game.players[1 - game.players.index(p)].score,
-                            "winner": con.user.username if p.score > game.players[1 - game.players.index(p)].score else self.active_connections[game.players[1 - game.players.index(p)].websocket_id].user.username
+                            "other_player_score": p.opponent.score,
+                            "winner": con.user.username if won else self.active_connections[p.opponent.websocket_id].user.username
                         },
-                        "t": "WON_GAME" if p.score > game.players[1 - game.players.index(p)].score else "LOSE_GAME"
+                        "t": "WON_GAME" if won else "LOSE_GAME"
                     })
 
-                await self.finish_game(connection, other_connection)
+                winner = None
+
+                if player.score > other_player.score:
+                    winner = connection
+                elif other_player.score > player.score:
+                    winner = other_connection
+
+                await self.finish_game(connection, other_connection, winner)
             else:
-                await other_connection.socket.send_json({
+                await self.send(other_connection.socket, {
                     "op": 0,
                     "d": {},
                     "t": "OTHER_PLAYER_FINISHED"
                 })
 
-                async def send_random_word():
-                    alfabets = "ABCÇDEFGĞHIİJKLMNOÖPRSŞTUÜVYZ"
+                self.schedule_auto_guess(connection.game_id, other_player.websocket_id)
+        elif other_player.predictions_count == game.room:
+            self.schedule_auto_guess(connection.game_id, wid)
 
-                    start = time.time()
-                    predictions = other_player.predictions_count
+    def schedule_auto_guess(self, game_id: str, wid: str):
+        self.timers.schedule(game_id, self.auto_guess_delay, lambda: self.auto_guess(game_id, wid))
 
-                    while True:
-                        if other_player.predictions_count != predictions:
-                            start = time.time()
-                            predictions = other_player.predictions_count
+    async def auto_guess(self, game_id: str, wid: str):
+        game = self.games.get(game_id)
+        connection = self.active_connections.get(wid)
 
-                        if other_player.predictions_count == game.room:
-                            break
+        if game is None or connection is None or connection.game_id != game_id:
+            return
 
-                        if time.time() - start >= 10:
-                            word = random.choice(self.valid_words[random.choice(alfabets)][str(len(player.word))])
-                            
-                            await self.check_word(other_player.websocket_id, {"word": word})
-                            
-                            start = time.time()
-                            predictions = other_player.predictions_count
+        word = self.valid_words.random_word(game.room)
 
-                        await asyncio.sleep(1)
+        if word is None:
+            return
 
-                asyncio.ensure_future(send_random_word())
+        await self.check_word(wid, {"word": word})
 
     async def check_word_exists(self, wid: str):
         connection = self.active_connections[wid]
@@ -711,20 +1413,15 @@ class ConnectionManager:
             return
         
         game_id = connection.game_id
-        game = self.games[game_id]
+        game = self.games.get(game_id)
 
         if game is None:
             return
         
-        if game.status != "accepted":
+        if game.status != GameStatus.ACCEPTED:
             return
         
-        player = None
-
-        for p in game.players:
-            if p.websocket_id != wid:
-                player = p
-                break
+        player = game.get_opponent(wid)
         
         if player is None:
             return
@@ -732,7 +1429,7 @@ class ConnectionManager:
         if player.word is None:
             game.timestamp = datetime.now().timestamp()
 
-            await connection.socket.send_json({
+            await self.send(connection.socket, {
                 "op": 0,
                 "d": {},
                 "t": "TRY_AGAIN"
@@ -742,7 +1439,7 @@ class ConnectionManager:
         
         other_connection = self.active_connections[player.websocket_id]
         
-        await connection.socket.send_json({
+        await self.send(connection.socket, {
             "op": 0,
             "d": {
                 "player_word": "",
@@ -754,7 +1451,7 @@ class ConnectionManager:
             "t": "LOSE_GAME"
         })
 
-        await other_connection.socket.send_json({
+        await self.send(other_connection.socket, {
             "op": 0,
             "d": {
                 "player_word": player.word,
@@ -766,7 +1463,9 @@ class ConnectionManager:
             "t": "WON_GAME"
         })
 
-        await self.finish_game(connection, other_connection)
+        player.score = 100
+
+        await self.finish_game(connection, other_connection, other_connection)
 
     async def time_is_up(self, wid: str):
         connection = self.active_connections[wid]
@@ -776,29 +1475,24 @@ class ConnectionManager:
         if game_id is None:
             return
 
-        game = self.games[game_id]
+        game = self.games.get(game_id)
 
         if game is None:
             return
 
-        player: Player
-        other_player: Player
+        player = game.get_player(wid)
 
-        for p in game.players:
-            if p.websocket_id == wid:
-                player = p
-            else:
-                other_player = p
-
-        if player is None or other_player is None:
+        if player is None:
             return
+
+        other_player = player.opponent
         
         if player.predictions_count == game.room:
             return
         
         other_connection = self.active_connections[other_player.websocket_id]
 
-        await connection.socket.send_json({
+        await self.send(connection.socket, {
             "op": 0,
             "d": {
                 "player_word": player.word,
@@ -810,7 +1504,7 @@ class ConnectionManager:
             "t": "LOSE_GAME"
         })
 
-        await other_connection.socket.send_json({
+        await self.send(other_connection.socket, {
             "op": 0,
             "d": {
                 "player_word": other_player.word,
@@ -822,7 +1516,9 @@ class ConnectionManager:
             "t": "WON_GAME"
         })
 
-        await self.finish_game(connection, other_connection)
+        other_player.score = 100
+
+        await self.finish_game(connection, other_connection, other_connection)
             
     async def quit_game(self, wid: str):
         connection = self.active_connections[wid]
@@ -832,32 +1528,24 @@ class ConnectionManager:
         if game_id is None:
             return
 
-        game = self.games[game_id]
+        game = self.games.get(game_id)
 
         if game is None:
             return
 
-        player: Player
-        other_player: Player
-
-        for p in game.players:
-            if p.websocket_id == wid:
-                player = p
-            else:
-                other_player = p
+        player = game.get_player(wid)
 
-        if player is None or other_player is None:
+        if player is None:
             return
+
+        other_player = player.opponent
         
-        if other_player.websocket_id in self.scores.keys():
-            self.scores[other_player.websocket_id] += 100
-        else:
-            self.scores[other_player.websocket_id] = 100
+        other_player.score = 100
 
         other_connection = self.active_connections[other_player.websocket_id]
         
         try:
-            await connection.socket.send_json({
+            await self.send(connection.socket, {
                 "op": 0,
                 "d": {
                     "player_word": player.word,
@@ -868,11 +1556,11 @@ class ConnectionManager:
                 },
                 "t": "LOSE_GAME"
             })
-        except:
-            print("Failed to send message")
+        except Exception:
+            logger.exception("send_failed", wid=wid)
         
         try:
-            await other_connection.socket.send_json({
+            await self.send(other_connection.socket, {
                 "op": 0,
                 "d": {
                     "player_word": other_player.word,
@@ -883,94 +1571,167 @@ class ConnectionManager:
                 },
                 "t": "WON_GAME"
             })
-        except:
-            print("Failed to send message")
+        except Exception:
+            logger.exception("send_failed", wid=other_player.websocket_id)
         
-        await self.finish_game(connection, other_connection)
+        await self.finish_game(connection, other_connection, other_connection)
     
     async def message(self, wid: str, payload: dict):
-        if "op" not in payload or "d" not in payload:
+        if not metrics.enabled:
+            await self.handle_message(wid, payload)
             return
-        
+
+        start = time.perf_counter()
+
+        try:
+            await self.handle_message(wid, payload)
+        finally:
+            op = payload.get("op") if isinstance(payload, dict) else None
+            handler_seconds.observe(time.perf_counter() - start, str(op) if op in self.dispatcher else "unknown")
+
+    # A frame that fails to parse or to run is answered with INVALID_FRAME
+    # and the connection carries on.
+    async def handle_message(self, wid: str, payload: dict):
         connection = self.active_connections[wid]
-        
-        if payload["op"] == 3:
-            await self.join_room(wid, payload["d"])
-            print(f"[LOG] {connection.user.username} JOINED ROOM! CHANNEL: {connection.channel}, ROOM: {connection.room}")
-        elif payload["op"] == 4:
-            await self.send_game_request(wid, payload["d"])
-            print(f"[LOG] {connection.user.username} SENT GAME REQUEST TO {self.active_connections[payload['d']['uid']].user.username}!")
-        elif payload["op"] == 5:
-            await self.accept_request(wid, payload["d"])
-            print(f"[LOG] {connection.user.username} ACCEPTED GAME REQUEST!")
-        elif payload["op"] == 6:
-            await self.decline_request(wid, payload["d"])
-            print(f"[LOG] {connection.user.username} DECLINED GAME REQUEST!")
-        elif payload["op"] == 7:
-            await self.confirm_word(wid, payload["d"])
-            print(f"[LOG] {connection.user.username} CONFIRMED WORD!")
-        elif payload["op"] == 10:
-            await self.check_word(wid, payload["d"])
-            print(f"[LOG] {connection.user.username} CHECKED WORD!")
-        elif payload["op"] == 11:
-            await self.check_word_exists(wid)
-            print(f"[LOG] {connection.user.username} CHECKED WORD EXISTS!")
-        elif payload["op"] == 12:
-            await self.time_is_up(wid)
-            print(f"[LOG] {connection.user.username} TIME IS UP!")
+        # Frames forwarded from another worker were limited where they
+        # arrived.
+        limited = connection.worker is None
+        now = time.monotonic()
+
+        # A client over the overall limit is flooding, so its frames are
+        # dropped without a reply.
+        if limited and not ratelimit.allow(connection.buckets, ratelimit.ANY, self.frame_limit, now):
+            throttled_frames.inc("all")
+            return
+
+        try:
+            route, data = self.dispatcher.parse(payload)
+        except FrameError as e:
+            await self.reject(connection, e)
+            return
+
+        if limited and route.limit is not None and not ratelimit.allow(connection.buckets, route.op, route.limit, now):
+            throttled_frames.inc(str(route.op))
+            await self.reject(connection, FrameError(route.op, RATE_LIMITED))
+            return
+
+        if route.forwarded and connection.worker is None:
+            host = await self.get_game_host(connection, payload)
+
+            if host is not None and host != self.worker_id:
+                await self.state.publish(worker_topic(host), { "kind": "frame", "wid": wid, "payload": payload })
+                return
+
+        try:
+            await route.handler(wid, data)
+        except Exception:
+            logger.exception("handler_failed", wid=wid, op=route.op)
+            await self.reject(connection, FrameError(route.op, FAILED))
+            return
+
+        if route.logged:
+            logger.info(
+                route.event,
+                wid=wid,
+                channel=connection.channel,
+                room=connection.room,
+                game_id=connection.game_id,
+                **{ key: data[key] for key in route.fields if key in data }
+            )
+
+    async def reject(self, connection: Connection, error: FrameError):
+        rejected_frames.inc(error.reason)
+
+        await self.send(connection.socket, error.to_event())
 
     async def disconnect(self, wid: str):
-        connection = self.active_connections[wid]
+        connection = self.active_connections.get(wid)
+
+        if connection is None:
+            return
 
-        if connection.user.status == Status.PLAYING:
-            await self.quit_game(wid)
+        self.heartbeats.untrack(wid)
+        self.matchmaker.dequeue(wid)
+        self.timers.cancel(f"resume:{wid}")
+
+        if connection.user is not None and connection.user.status in (Status.PLAYING, Status.WAITING_RECONNECT) and connection.game_id is not None:
+            if connection.game_host not in (None, self.worker_id):
+                await self.state.publish(worker_topic(connection.game_host), { "kind": "quit", "wid": wid })
+            else:
+                await self.quit_game(wid)
 
         del self.active_connections[wid]
+
+        if isinstance(connection.socket, Outbox):
+            connection.socket.abort()
+
         await self.check_room(wid, connection)
+        await self.state.delete_user(wid)
 
     async def invalid_session(self, wid: str):
         connection = self.active_connections[wid]
 
-        await connection.socket.send_json({"op": 8, "d": False})
+        await self.send(connection.socket, Event(op=8, d=False))
         await connection.socket.close()
 
 manager = ConnectionManager()
 
+def count_by(values) -> dict[tuple[str, ...], int]:
+    counts: dict[tuple[str, ...], int] = {}
+
+    for value in values:
+        counts[(value,)] = counts.get((value,), 0) + 1
+
+    return counts
+
+# Gauges are read from the manager at scrape time, so they cost nothing on
+# the hot path.
+metrics.gauge("wordle_gateway_connections", "Sessions held by this worker", ("status",), callback=lambda: count_by(
+    c.user.status.name.lower() if c.user is not None else "identifying"
+    for c in manager.active_connections.values()
+    if c.worker is None
+))
+metrics.gauge("wordle_gateway_games", "Games hosted by this worker", ("status",), callback=lambda: count_by(
+    g.status.value for g in manager.games.values()
+))
+metrics.gauge("wordle_gateway_room_users", "Users in each room across workers", ("channel", "room"), callback=lambda: {
+    (channel, str(number)): len(room) for channel, rooms in manager.channels.items() for number, room in rooms.items()
+})
+metrics.gauge("wordle_gateway_matchmaking_queued", "Players waiting in the matchmaking queue", callback=lambda: len(manager.matchmaker.rooms))
+metrics.gauge("wordle_gateway_outbox_depth", "Frames queued across all outboxes", callback=lambda: manager.outbox_metrics()["depth"])
+metrics.gauge("wordle_gateway_outbox_max_depth", "Frames queued in the fullest outbox", callback=lambda: manager.outbox_metrics()["max_depth"])
+metrics.counter("wordle_gateway_outbox_frames_total", "Frames handled by the outboxes", ("result",), callback=lambda: {
+    (result,): getattr(manager.outbox_stats, result) for result in ("sent", "dropped", "coalesced", "overflows", "failed")
+})
+metrics.counter("wordle_gateway_expired_games_total", "Games expired by the sweeper", ("reason",), callback=lambda: {
+    (reason,): count for reason, count in manager.expired_games.items()
+})
+metrics.gauge("wordle_results_pending", "Finished games waiting to be written", callback=lambda: len(manager.results.pending))
+
 @app.websocket("/gateway")
 async def connect_websocket(websocket: WebSocket):
     websocket_id = await manager.connect(websocket)
 
-    last_heartbeat_sent = time.time()
-    heartbeat_interval = 10.0
-
-    async def handle_heartbeats():
-        while True:
-            if time.time() - last_heartbeat_sent >= heartbeat_interval:
-                try:
-                    await manager.quit_game(websocket_id)
-                    await websocket.close()
-                    break
-                except:
-                    break
-
-            await asyncio.sleep(1)
-    
-    asyncio.ensure_future(handle_heartbeats())
-
     try:
         while True:
-            data = await websocket.receive_json()
+            text = await websocket.receive_text()
 
-            if data["op"] == 1:
-                last_heartbeat_sent = time.time()
+            try:
+                data = encoding.loads(text)
+            except encoding.DecodeError:
+                data = None
 
-                await websocket.send_json({"op": 11})
+            if isinstance(data, dict) and data.get("op") == 1:
+                await manager.heartbeat(websocket_id)
             else:
                 await manager.message(websocket_id, data)
 
-    except Exception as e:
-        print("Error:", e)
-        try:
-            await manager.disconnect(websocket_id)
-        except:
-            print("Error while send disconnect message")
\ No newline at end of file
+    except WebSocketDisconnect as e:
+        logger.info("socket_closed", wid=websocket_id, code=e.code)
+    except Exception:
+        logger.exception("socket_failed", wid=websocket_id)
+
+    try:
+        await manager.suspend(websocket_id, websocket)
+    except Exception:
+        logger.exception("suspend_failed", wid=websocket_id)
\ No newline at end of file
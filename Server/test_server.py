@@ -0,0 +1,102 @@
+from gateway.state import MemoryBackend
+from server import Connection, ConnectionManager, Status, UserDetails
+
+import asyncio
+import json
+
+class FakeSocket:
+    def __init__(self) -> None:
+        self.sent: list[dict] = []
+
+    async def send_text(self, text: str):
+        # Yields like a real socket, so other handlers run while it writes.
+        await asyncio.sleep(0)
+        self.sent.append(json.loads(text))
+
+    async def close(self):
+        pass
+
+def connect(manager: ConnectionManager, name: str) -> FakeSocket:
+    socket = FakeSocket()
+    user = UserDetails(uid=name, username=name, status=Status.ONLINE)
+    manager.active_connections[name] = Connection(socket, user)
+
+    return socket
+
+# A client's roster is itself, its JOIN_ROOM snapshot and the events sent
+# after it.
+def roster(name: str, sent: list[dict]) -> tuple[set[str], int]:
+    users = set()
+    version = 0
+
+    for frame in sent:
+        if frame["t"] == "JOIN_ROOM":
+            users = { name } | { user["uid"] for user in frame["d"]["users"] }
+            version = frame["d"]["version"]
+        elif frame["t"] == "USER_JOIN_ROOM" and frame["d"]["version"] > version:
+            users.add(frame["d"]["user"]["uid"])
+            version = frame["d"]["version"]
+
+    return users, version
+
+def test_concurrent_joins_see_each_other():
+    async def main():
+        manager = ConnectionManager()
+        sockets = { name: connect(manager, name) for name in ("a", "b", "c") }
+
+        await manager.join_room("a", { "channel": "harfli", "room": 5 })
+        await asyncio.gather(
+            manager.join_room("b", { "channel": "harfli", "room": 5 }),
+            manager.join_room("c", { "channel": "harfli", "room": 5 })
+        )
+
+        return manager.channels["harfli"][5], sockets
+
+    room, sockets = asyncio.run(main())
+
+    for name, socket in sockets.items():
+        users, version = roster(name, socket.sent)
+
+        assert users == { "a", "b", "c" }
+        assert version == room.version
+
+def test_game_request_reaches_another_worker():
+    async def main():
+        state = MemoryBackend()
+        managers = [ConnectionManager(), ConnectionManager()]
+
+        for manager in managers:
+            manager.state = state
+            await manager.start()
+
+        sockets = { "a": connect(managers[0], "a"), "b": connect(managers[1], "b") }
+
+        await managers[1].set_status(managers[1].active_connections["b"], Status.ONLINE, None)
+        await managers[0].send_game_request("a", { "uid": "b" })
+        await asyncio.sleep(0.05)
+
+        for manager in managers:
+            await manager.stop()
+
+        return managers[0], sockets
+
+    host, sockets = asyncio.run(main())
+    frames = [frame for frame in sockets["b"].sent if frame["t"] == "GAME_REQUEST"]
+
+    assert len(frames) == 1
+    assert frames[0]["d"]["from"]["uid"] == "a"
+    assert frames[0]["d"]["game_id"] in host.games
+    assert host.active_connections["b"].worker is not None
+
+def test_resume_needs_the_matching_token():
+    manager = ConnectionManager()
+    connect(manager, "a")
+    connection = manager.active_connections["a"]
+    connection.user.account_id = "account"
+    connection.resume_token = "token"
+
+    for resume in ({ "wid": ["a"], "token": "token" }, { "wid": "a", "token": 5 }, { "wid": "a", "token": "tökén" }, { "wid": "a", "token": "other" }):
+        assert manager.get_resumable({ "resume": resume }, "account") is None
+
+    assert manager.get_resumable({ "resume": { "wid": "a", "token": "token" } }, "account") is connection
+    assert manager.get_resumable({ "resume": { "wid": "a", "token": "token" } }, "someone") is None